@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark batch embedding generation in the dummy AI endpoint.
+
+Compares the old per-input loop (one NumPy array, normalization and list
+conversion per string) with the batched matrix path used by /v1/embeddings.
+The "matrix" column is what base64 encoding starts from; "+lists" adds the
+conversion to Python floats needed for encoding_format="float".
+
+Run from the repository root:
+    python benchmarks/bench_embeddings.py
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dummy_ai_endpoint import embedding_cache, generate_random_embeddings, generate_hash_based_embeddings
+
+BATCH_SIZES = [1, 16, 256, 2048]
+DIMENSIONS = [768, 1536, 3072]
+
+def legacy_random(count, dimensions):
+    """Per-input generation as done before batching"""
+    rows = []
+    for _ in range(count):
+        embedding = np.random.randn(dimensions)
+        embedding = embedding / np.linalg.norm(embedding)
+        rows.append(embedding.tolist())
+    return rows
+
+def batched_random(count, dimensions):
+    """Whole batch as one matrix"""
+    return generate_random_embeddings(count, dimensions)
+
+def legacy_hash(texts, dimensions):
+    """Per-input hash-based generation as done before batching"""
+    import hashlib
+    rows = []
+    for text in texts:
+        text_hash = hashlib.sha256(text.encode()).hexdigest()
+        np.random.seed(int(text_hash[:8], 16))
+        embedding = np.random.randn(dimensions)
+        embedding = embedding / np.linalg.norm(embedding)
+        rows.append(embedding.tolist())
+    return rows
+
+def batched_hash(texts, dimensions):
+    """Hash-based batch as one matrix"""
+    return generate_hash_based_embeddings(texts, dimensions)
+
+def as_lists(batched):
+    """Batched generation followed by conversion to Python lists (float encoding)"""
+    return lambda *args: batched(*args).tolist()
+
+def best_of(func, *args, repeat=3):
+    """Return the best wall-clock time of several runs"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    # Measure generation itself rather than LRU cache hits
+    embedding_cache.maxsize = 0
+    print(f"{'mode':<8} {'batch':>6} {'dims':>6} {'legacy ms':>11} {'matrix ms':>11} {'speedup':>8} {'+lists ms':>11}")
+    print("-" * 68)
+    for dimensions in DIMENSIONS:
+        for count in BATCH_SIZES:
+            texts = [f"input text number {i}" for i in range(count)]
+            cases = [
+                ("random", legacy_random, batched_random, (count, dimensions)),
+                ("hash", legacy_hash, batched_hash, (texts, dimensions)),
+            ]
+            for mode, legacy, batched, args in cases:
+                legacy_time = best_of(legacy, *args)
+                batched_time = best_of(batched, *args)
+                lists_time = best_of(as_lists(batched), *args)
+                print(f"{mode:<8} {count:>6} {dimensions:>6} {legacy_time * 1000:>11.2f} "
+                      f"{batched_time * 1000:>11.2f} {legacy_time / batched_time:>7.1f}x "
+                      f"{lists_time * 1000:>11.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -3,45 +3,76 @@ import argparse
 import asyncio
 import json
 import logging
+import logging.handlers
+import gzip
+import glob
+import shutil
 import sys
-import copy
 import time
 import uuid
-from datetime import datetime
-from typing import Any, Dict, List, Optional, Union
-from queue import Queue
+import itertools
+import functools
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Union
+from collections import OrderedDict
+from queue import Queue, Empty, Full
 import threading
 import hashlib
 import os
 import base64
-import struct
 import secrets
+import bisect
+import re
+import random
+import math
+import string
+import csv
+import io
+import sqlite3
 
 import uvicorn
-from fastapi import FastAPI, Request, Response, WebSocket, WebSocketDisconnect, HTTPException, Depends
-from fastapi.responses import StreamingResponse, HTMLResponse
+from fastapi import FastAPI, Request, Response, WebSocket, WebSocketDisconnect, HTTPException, Depends, Query
+from fastapi.responses import StreamingResponse, HTMLResponse, JSONResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, Field
 import numpy as np
+from json.encoder import encode_basestring_ascii as encode_json_string
 
-# Configure logging
+# Configure logging (the rotating log file is added by configure_file_logging at startup)
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
+    format=LOG_FORMAT,
     handlers=[
-        logging.FileHandler('dummy_ai_endpoint_requests.log'),
         logging.StreamHandler(sys.stdout)
     ]
 )
 logger = logging.getLogger(__name__)
 
+def configure_file_logging(path: str = 'dummy_ai_endpoint_requests.log', max_bytes: int = 64 * 1024 * 1024,
+                           backup_count: int = 5):
+    """Add the text log file, rotated by size into gzip-compressed backups"""
+    def namer(name: str) -> str:
+        return name + ".gz"
+    
+    def rotator(source: str, dest: str):
+        with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(source)
+    
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+    handler.namer = namer
+    handler.rotator = rotator
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    logging.getLogger().addHandler(handler)
+
 app = FastAPI(title="Dummy AI Endpoint - OpenAI & Anthropic Compatible")
 
 # Global state
 pending_requests = {}
 websocket_clients = []
-response_mode = "cli"  # "cli" or "web"
+response_mode = "cli"  # "cli", "web" or "synthetic"
 remote_mode = False
 api_key = None
 advanced_mode = False  # Show raw HTTP requests
@@ -69,6 +100,24 @@ async def verify_api_key(request: Request, credentials: Optional[HTTPAuthorizati
         )
     return credentials
 
+# Responses with at least this many embedding values are streamed (0 disables streaming)
+embedding_stream_threshold = 4 * 1024 * 1024
+# Approximate number of values generated per block when streaming embeddings
+EMBEDDING_STREAM_BLOCK_VALUES = 64 * 1024
+# Significant digits used when streaming float embeddings
+EMBEDDING_FLOAT_PRECISION = 8
+
+# encoding_format values besides "float"; float16 and binary are base64 encoded,
+# int8 is a list of integers with a per-vector scale
+EMBEDDING_ENCODING_FORMATS = ("base64", "float16", "int8", "binary")
+
+# File mode: answer unknown texts with the embedding of the most similar known text
+embedding_nn_fallback = False
+# Similarity passed to generate_similar_embedding for nearest-text matches (1.0 returns them unchanged)
+embedding_nn_similarity = 1.0
+# Minimum estimated trigram Jaccard similarity for a nearest-text match
+EMBEDDING_NN_MIN_SIMILARITY = 0.2
+
 # Embedding model dimensions
 EMBEDDING_DIMENSIONS = {
     "text-embedding-ada-002": 1536,
@@ -145,7 +194,7 @@ class CompletionRequest(BaseModel):
 class EmbeddingRequest(BaseModel):
     model: str
     input: Union[str, List[str]]
-    encoding_format: Optional[str] = "float"  # "float" or "base64"
+    encoding_format: Optional[str] = "float"  # "float", "base64", "float16", "int8" or "binary"
     dimensions: Optional[int] = None
     user: Optional[str] = None
     seed: Optional[int] = None
@@ -184,94 +233,1333 @@ async def format_raw_request(request: Request, body: bytes = None) -> str:
     
     return raw_request
 
-def log_request(endpoint: str, request_data: Dict[str, Any]):
-    """Log the incoming request details, truncating base64 data in logs."""
-    # Create a deep copy to avoid modifying the original request data
-    request_data_copy = copy.deepcopy(request_data)
-
-    # Truncate base64 data in the copy
-    if "messages" in request_data_copy:
-        for message in request_data_copy["messages"]:
-            if isinstance(message.get("content"), list):
-                for content_item in message["content"]:
-                    if not isinstance(content_item, dict):
+def log_record_timestamp(line: str) -> Optional[str]:
+    """Return the ISO timestamp of a JSON log line"""
+    # Records are written with the timestamp first, so avoid parsing the whole line
+    prefix = '{"timestamp": "'
+    if line.startswith(prefix):
+        end = line.find('"', len(prefix))
+        if end != -1:
+            return line[len(prefix):end]
+    try:
+        return json.loads(line).get("timestamp")
+    except (ValueError, AttributeError):
+        return None
+
+def compress_log_segment(source_path: str, dest_path: str, index_every: int = 1000) -> Dict[str, Any]:
+    """Compress a closed JSONL log into gzip members of index_every records and write its index"""
+    blocks = []
+    group = []
+    records = 0
+    first_timestamp = last_timestamp = None
+    tmp_path = dest_path + ".tmp"
+    
+    with open(source_path, 'r', encoding='utf-8') as src, open(tmp_path, 'wb') as dest:
+        def flush_group():
+            # Each group is an independent gzip member, so readers can start decompressing at its offset
+            blocks.append({
+                "offset": dest.tell(),
+                "record": records - len(group),
+                "timestamp": log_record_timestamp(group[0])
+            })
+            dest.write(gzip.compress(''.join(group).encode('utf-8')))
+            group.clear()
+        
+        for line in src:
+            if not line.strip():
+                continue
+            if not line.endswith('\n'):
+                line += '\n'
+            group.append(line)
+            records += 1
+            timestamp = log_record_timestamp(line)
+            if timestamp:
+                first_timestamp = first_timestamp or timestamp
+                last_timestamp = timestamp
+            if len(group) >= index_every:
+                flush_group()
+        if group:
+            flush_group()
+    
+    os.replace(tmp_path, dest_path)
+    index = {
+        "segment": os.path.basename(dest_path),
+        "records": records,
+        "first_timestamp": first_timestamp,
+        "last_timestamp": last_timestamp,
+        "index_every": index_every,
+        "blocks": blocks
+    }
+    # The index is written last; a segment without one is incomplete
+    with open(dest_path + ".idx.json", 'w') as f:
+        json.dump(index, f)
+    return index
+
+def list_log_segments(log_path: str = 'request_log.json') -> List[Dict[str, Any]]:
+    """Return the indexes of all compressed segments of a request log, oldest first"""
+    stem = os.path.splitext(log_path)[0]
+    indexes = []
+    for index_path in glob.glob(f"{glob.escape(stem)}-*.jsonl.gz.idx.json"):
+        try:
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            continue
+        index["path"] = index_path[:-len(".idx.json")]
+        indexes.append(index)
+    indexes.sort(key=lambda index: (index["first_timestamp"] or "", index["path"]))
+    return indexes
+
+def iter_log_lines(log_path: str = 'request_log.json', since: Optional[str] = None,
+                   until: Optional[str] = None):
+    """Yield JSON log lines with since <= timestamp <= until from compressed segments and the active log"""
+    for index in list_log_segments(log_path):
+        if since and index["last_timestamp"] and index["last_timestamp"] < since:
+            continue
+        if until and index["first_timestamp"] and index["first_timestamp"] > until:
+            continue
+        # Start at the last block that begins before the requested time range
+        offset = 0
+        for block in index["blocks"]:
+            if since and block["timestamp"] and block["timestamp"] <= since:
+                offset = block["offset"]
+            else:
+                break
+        with open(index["path"], 'rb') as f:
+            f.seek(offset)
+            with gzip.GzipFile(fileobj=f) as segment:
+                for raw_line in segment:
+                    line = raw_line.decode('utf-8')
+                    timestamp = log_record_timestamp(line) or ""
+                    if since and timestamp < since:
                         continue
+                    if until and timestamp > until:
+                        break
+                    yield line.rstrip('\n')
+    
+    try:
+        with open(log_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                timestamp = log_record_timestamp(line) or ""
+                if since and timestamp < since:
+                    continue
+                if until and timestamp > until:
+                    break
+                yield line.rstrip('\n')
+    except FileNotFoundError:
+        return
 
-                    # OpenAI image_url format
-                    if content_item.get("type") == "image_url":
-                        image_url_dict = content_item.get("image_url", {})
-                        if isinstance(image_url_dict, dict):
-                            url = image_url_dict.get("url", "")
-                            if url.startswith("data:") and ";base64," in url:
-                                parts = url.split(";base64,", 1)
-                                if len(parts) == 2:
-                                    media_type_part = parts[0]
-                                    base64_string = parts[1]
-                                    if len(base64_string) > 30:
-                                        truncated_base64 = base64_string[:30] + "... (truncated)"
-                                        image_url_dict["url"] = f"{media_type_part};base64,{truncated_base64}"
-
-                    # Anthropic image format
-                    elif content_item.get("type") == "image":
-                        source = content_item.get("source", {})
-                        if isinstance(source, dict) and source.get("type") == "base64":
-                            base64_string = source.get("data", "")
-                            if len(base64_string) > 30:
-                                source["data"] = base64_string[:30] + "... (truncated)"
-
-    log_entry_copy = {
-        "timestamp": datetime.now().isoformat(),
-        "endpoint": endpoint,
-        "request": request_data_copy  # Use the modified copy for logging
+# Scalar fields of compacted log segments; bodies live in the .blobs file next to them
+COMPACT_LOG_DTYPE = np.dtype([
+    ("timestamp", "datetime64[ms]"),
+    # Model names come from clients, so a segment can hold more than 65535 distinct ones
+    ("endpoint", "<u4"),  # Index into the endpoints list of the .columns.json sidecar
+    ("model", "<u4"),  # Index into the models list
+    ("prompt_tokens", "<i4"),  # -1 when the response was not logged
+    ("completion_tokens", "<i4"),
+    ("latency_ms", "<f4"),  # NaN when the response was not logged
+    ("status", "<i2"),  # 0 when the response was not logged
+    ("request_offset", "<i8"),
+    ("request_length", "<i4"),
+    ("response_offset", "<i8"),
+    ("response_length", "<i4"),
+])
+COMPACT_LOG_GROUPS = ("model", "endpoint", "status", "hour", "day")
+
+def compact_log_paths(segment_path: str) -> tuple:
+    """Columns, blobs and sidecar paths for a compressed log segment"""
+    stem = segment_path[:-len(".jsonl.gz")] if segment_path.endswith(".jsonl.gz") else segment_path
+    return f"{stem}.columns.npy", f"{stem}.blobs", f"{stem}.columns.json"
+
+def read_log_file_lines(path: str, limit: Optional[int] = None):
+    """Yield lines of a compressed segment or the plain active log"""
+    opener = gzip.open if path.endswith(".gz") else open
+    try:
+        with opener(path, 'rt', encoding='utf-8') as f:
+            for line in itertools.islice(f, limit):
+                if line.strip():
+                    yield line.rstrip('\n')
+    except FileNotFoundError:
+        return
+
+def compact_log_segment(segment_path: str, next_path: Optional[str] = None,
+                        lookahead: int = 1000) -> Dict[str, Any]:
+    """Write the scalar fields of a closed segment as a NumPy structured array and its bodies to a blob file"""
+    columns_path, blobs_path, sidecar_path = compact_log_paths(segment_path)
+    endpoints, models = {}, {}
+    rows, row_by_id = [], {}
+    
+    with open(blobs_path + ".tmp", 'wb') as blobs:
+        def append_blob(text: Any) -> tuple:
+            if text is None:
+                return -1, 0
+            if not isinstance(text, str):
+                # Blob store reference
+                text = json.dumps(text)
+            data = text.encode('utf-8')
+            offset = blobs.tell()
+            blobs.write(data)
+            return offset, len(data)
+        
+        def apply_response(record: Dict[str, Any]):
+            row = row_by_id.get(record.get("id"))
+            if row is None:
+                return
+            usage = record.get("usage") or {}
+            row[3] = usage.get("prompt_tokens", -1)
+            row[4] = usage.get("completion_tokens", -1)
+            row[5] = record.get("latency_ms", float("nan"))
+            row[6] = record.get("status") or 0
+            row[9], row[10] = append_blob(record.get("response"))
+        
+        for line in read_log_file_lines(segment_path):
+            record = json.loads(line)
+            if record.get("event"):
+                if record["event"] == "response":
+                    apply_response(record)
+                continue
+            request_data = record.get("request") or {}
+            model = str(request_data.get("model", "")) if isinstance(request_data, dict) else ""
+            row = [
+                np.datetime64(record.get("timestamp") or "NaT", "ms"),
+                endpoints.setdefault(record.get("endpoint", ""), len(endpoints)),
+                models.setdefault(model, len(models)),
+                -1, -1, float("nan"), 0,
+                *append_blob(json.dumps(request_data)),
+                -1, 0
+            ]
+            rows.append(row)
+            if record.get("id"):
+                row_by_id[record["id"]] = row
+        
+        # Responses to the last requests of a segment are usually logged at the start of the next one
+        if next_path:
+            for line in read_log_file_lines(next_path, lookahead):
+                if is_event_record(line):
+                    apply_response(json.loads(line))
+    
+    columns = np.array([tuple(row) for row in rows], dtype=COMPACT_LOG_DTYPE)
+    with open(columns_path + ".tmp", 'wb') as f:
+        np.save(f, columns)
+    os.replace(blobs_path + ".tmp", blobs_path)
+    os.replace(columns_path + ".tmp", columns_path)
+    
+    # Written last: a segment counts as compacted once its sidecar exists
+    sidecar = {
+        "segment": os.path.basename(segment_path),
+        "rows": len(rows),
+        "endpoints": list(endpoints),
+        "models": list(models)
     }
-    logger.info(f"\n{'='*80}\nNEW REQUEST TO {endpoint}\n{'='*80}")
-    logger.info(json.dumps(log_entry_copy, indent=2))
+    with open(sidecar_path + ".tmp", 'w') as f:
+        json.dump(sidecar, f)
+    os.replace(sidecar_path + ".tmp", sidecar_path)
+    return sidecar
+
+def compact_logs(log_path: str = 'request_log.json', lookahead: int = 1000) -> List[Dict[str, Any]]:
+    """Compact every closed log segment that has not been compacted yet"""
+    segments = [index["path"] for index in list_log_segments(log_path)]
+    compacted = []
+    for position, segment_path in enumerate(segments):
+        sidecar_path = compact_log_paths(segment_path)[2]
+        if os.path.exists(sidecar_path) and os.path.getmtime(sidecar_path) >= os.path.getmtime(segment_path):
+            continue
+        next_path = segments[position + 1] if position + 1 < len(segments) else log_path
+        compacted.append(compact_log_segment(segment_path, next_path, lookahead))
+    return compacted
+
+def aggregate_compacted_logs(log_path: str = 'request_log.json', group_by: List[str] = ("model",)) -> List[Dict[str, Any]]:
+    """Request counts, token totals and latency per group over all compacted segments"""
+    totals = {}
+    # Compacted columns outlive raw segments pruned by --log-max-segments
+    stem = os.path.splitext(log_path)[0]
+    for sidecar_path in sorted(glob.glob(f"{glob.escape(stem)}-*.columns.json")):
+        columns_path = sidecar_path[:-len(".json")] + ".npy"
+        with open(sidecar_path) as f:
+            sidecar = json.load(f)
+        columns = np.load(columns_path, mmap_mode='r')
+        if not len(columns):
+            continue
+        
+        # Integer keys per group field, combined into one mixed-radix key for a single 1-D np.unique
+        keys, labels = [], []
+        for field in group_by:
+            if field in ("model", "endpoint"):
+                keys.append(columns[field].astype(np.int64))
+                labels.append(sidecar[field + "s"])
+            elif field == "status":
+                keys.append(columns["status"].astype(np.int64))
+                labels.append(None)
+            else:
+                unit = "h" if field == "hour" else "D"
+                keys.append(columns["timestamp"].astype(f"datetime64[{unit}]").astype(np.int64))
+                labels.append(unit)
+        combined = np.zeros(len(columns), dtype=np.int64)
+        field_values = []
+        for key in keys:
+            values, codes = np.unique(key, return_inverse=True)
+            combined = combined * len(values) + codes.reshape(-1)
+            field_values.append(values)
+        unique_combined, inverse = np.unique(combined, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        unique_keys = np.empty((len(unique_combined), len(keys)), dtype=np.int64)
+        remainder = unique_combined.copy()
+        for position in range(len(keys) - 1, -1, -1):
+            values = field_values[position]
+            unique_keys[:, position] = values[remainder % len(values)]
+            remainder //= len(values)
+        
+        prompt_tokens = np.clip(columns["prompt_tokens"], 0, None).astype(np.int64)
+        completion_tokens = np.clip(columns["completion_tokens"], 0, None).astype(np.int64)
+        latency = columns["latency_ms"].astype(np.float64)
+        has_latency = ~np.isnan(latency)
+        sums = {
+            "requests": np.bincount(inverse, minlength=len(unique_keys)),
+            "prompt_tokens": np.bincount(inverse, prompt_tokens, len(unique_keys)),
+            "completion_tokens": np.bincount(inverse, completion_tokens, len(unique_keys)),
+            "errors": np.bincount(inverse, columns["status"] >= 400, len(unique_keys)),
+            "latency_count": np.bincount(inverse, has_latency, len(unique_keys)),
+            "latency_sum": np.bincount(inverse, np.where(has_latency, latency, 0), len(unique_keys))
+        }
+        
+        for position, key in enumerate(unique_keys):
+            group = []
+            for value, label in zip(key, labels):
+                if isinstance(label, list):
+                    group.append(label[value])
+                elif label is None:
+                    group.append(int(value))
+                else:
+                    group.append(str(np.datetime64(int(value), label)))
+            entry = totals.setdefault(tuple(group), dict.fromkeys(sums, 0))
+            for name, values in sums.items():
+                entry[name] += values[position]
     
-    # Also save to a JSON file for easy parsing, using the modified copy
-    with open('request_log.json', 'a') as f:
-        f.write(json.dumps(log_entry_copy) + '\n')
+    results = []
+    for group, entry in sorted(totals.items(), key=lambda item: tuple(str(value) for value in item[0])):
+        results.append({
+            **dict(zip(group_by, group)),
+            "requests": int(entry["requests"]),
+            "prompt_tokens": int(entry["prompt_tokens"]),
+            "completion_tokens": int(entry["completion_tokens"]),
+            "errors": int(entry["errors"]),
+            "avg_latency_ms": round(entry["latency_sum"] / entry["latency_count"], 3) if entry["latency_count"] else None
+        })
+    return results
 
-def get_cli_response(prompt_info: str) -> str:
-    """Get response from user via terminal"""
+class RequestLogWriter:
+    """Background thread that prints log records and appends them to the JSON log in batches"""
+    
+    def __init__(self, path: str = 'request_log.json', max_queue: int = 10000,
+                 flush_interval: float = 0.5, overflow: str = "drop",
+                 max_bytes: int = 64 * 1024 * 1024, rotate_interval: float = 0,
+                 index_every: int = 1000, max_segments: int = 0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.overflow = overflow  # "drop" new records or "block" the request until there is room
+        self.max_bytes = max_bytes  # Rotate the active log at this size (0 disables)
+        self.rotate_interval = rotate_interval  # Rotate the active log after this many seconds (0 disables)
+        self.index_every = index_every
+        self.max_segments = max_segments  # Delete the oldest compressed segments beyond this count (0 keeps all)
+        self.written = 0
+        self.dropped = 0
+        self.segments = 0
+        self._segment_started = time.time()
+        self._queue = Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+    
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="request-log-writer", daemon=True)
+                self._thread.start()
+    
+    async def submit(self, entry: Union[str, Callable[[], str]]) -> bool:
+        """Queue a serialized JSON record, or a function that serializes one on the writer thread"""
+        while True:
+            if self.submit_nowait(entry, count_drop=self.overflow != "block"):
+                return True
+            if self.overflow != "block":
+                return False
+            # Backpressure: hold this request until the writer catches up
+            await asyncio.sleep(0.01)
+    
+    def submit_nowait(self, entry: Union[str, Callable[[], str]], count_drop: bool = True) -> bool:
+        """Queue a record without waiting, dropping it if the queue is full"""
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait(entry)
+            return True
+        except Full:
+            if count_drop:
+                self.dropped += 1
+            return False
+    
+    def close(self):
+        """Flush queued records and stop the writer thread"""
+        with self._start_lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "overflow": self.overflow,
+            "segments_rotated": self.segments
+        }
+    
+    def _drain(self) -> List[str]:
+        batch = []
+        try:
+            while True:
+                batch.append(self._queue.get_nowait())
+        except Empty:
+            return batch
+    
+    def _run(self):
+        self._compress_leftovers()
+        self._segment_started = time.time()
+        while True:
+            stopping = self._stop.wait(self.flush_interval)
+            batch = self._drain()
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    logger.error(f"Failed to write {len(batch)} request log records: {e}")
+            try:
+                self._maybe_rotate()
+            except Exception as e:
+                logger.error(f"Failed to rotate request log {self.path}: {e}")
+            if stopping:
+                return
+    
+    def _serialize(self, batch: List[Union[str, Callable[[], str]]]) -> List[str]:
+        lines = []
+        for entry in batch:
+            if not callable(entry):
+                lines.append(entry)
+                continue
+            try:
+                lines.append(entry())
+            except Exception as e:
+                logger.error(f"Failed to serialize a request log record: {e}")
+        return lines
+    
+    def _write(self, batch: List[Union[str, Callable[[], str]]]):
+        batch = self._serialize(batch)
+        for line in batch:
+            entry = json.loads(line)
+            if entry.get("event") == "response":
+                logger.info(f"Response to {entry['id']}: {entry['status']} in {entry['latency_ms']} ms")
+                continue
+            if entry.get("event") == "summary":
+                logger.info(f"Requests not logged since {entry['since']}: {json.dumps(entry['endpoints'])}")
+                continue
+            logger.info(f"\n{'='*80}\nNEW REQUEST TO {entry['endpoint']}\n{'='*80}\n"
+                        f"{json.dumps(entry, indent=2)}")
+        # Also save to a JSON file for easy parsing, one write per batch
+        with open(self.path, 'a') as f:
+            f.write(''.join(line + '\n' for line in batch))
+        self.written += len(batch)
+    
+    def _maybe_rotate(self):
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        too_big = self.max_bytes > 0 and size >= self.max_bytes
+        too_old = self.rotate_interval > 0 and time.time() - self._segment_started >= self.rotate_interval
+        if size and (too_big or too_old):
+            self._rotate()
+    
+    def _rotate(self):
+        """Close the active log and turn it into a compressed, indexed segment"""
+        stem = os.path.splitext(self.path)[0]
+        name = f"{stem}-{datetime.now().strftime('%Y%m%dT%H%M%S')}"
+        suffix = 1
+        while os.path.exists(f"{name}.jsonl") or os.path.exists(f"{name}.jsonl.gz"):
+            suffix += 1
+            name = f"{stem}-{datetime.now().strftime('%Y%m%dT%H%M%S')}-{suffix}"
+        
+        closed_path = f"{name}.jsonl"
+        os.replace(self.path, closed_path)
+        self._segment_started = time.time()
+        compress_log_segment(closed_path, closed_path + ".gz", self.index_every)
+        os.remove(closed_path)
+        self.segments += 1
+        
+        if self.max_segments > 0:
+            for index in list_log_segments(self.path)[:-self.max_segments]:
+                for path in (index["path"], index["path"] + ".idx.json"):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+    
+    def _compress_leftovers(self):
+        """Finish rotations that were interrupted, e.g. by a crash during compression"""
+        stem = os.path.splitext(self.path)[0]
+        for closed_path in glob.glob(f"{glob.escape(stem)}-*.jsonl"):
+            try:
+                compress_log_segment(closed_path, closed_path + ".gz", self.index_every)
+                os.remove(closed_path)
+            except Exception as e:
+                logger.error(f"Failed to compress leftover request log {closed_path}: {e}")
+
+request_log_writer = RequestLogWriter()
+
+class RequestStore:
+    """SQLite database of captured requests, written in batches by a background thread"""
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS requests (
+            id TEXT PRIMARY KEY,
+            ts TEXT NOT NULL,
+            endpoint TEXT NOT NULL,
+            model TEXT,
+            api_key TEXT,
+            status INTEGER,
+            latency_ms REAL,
+            request_body TEXT,
+            response_body TEXT,
+            last_user_message TEXT
+        );
+        CREATE INDEX IF NOT EXISTS requests_endpoint ON requests (endpoint, ts);
+        CREATE INDEX IF NOT EXISTS requests_model ON requests (model, ts);
+        CREATE INDEX IF NOT EXISTS requests_ts ON requests (ts);
+        CREATE INDEX IF NOT EXISTS requests_api_key ON requests (api_key, ts);
+        CREATE INDEX IF NOT EXISTS requests_status ON requests (status, ts);
+        CREATE INDEX IF NOT EXISTS requests_latency ON requests (latency_ms);
+    """
+    # Full-text index of the last user message, kept in sync by a trigger
+    FTS_SCHEMA = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS requests_fts USING fts5(
+            last_user_message, content='requests', content_rowid='rowid'
+        );
+        CREATE TRIGGER IF NOT EXISTS requests_fts_insert AFTER INSERT ON requests BEGIN
+            INSERT INTO requests_fts (rowid, last_user_message) VALUES (new.rowid, new.last_user_message);
+        END;
+    """
+    INSERT = ("INSERT OR IGNORE INTO requests (id, ts, endpoint, model, api_key, request_body, last_user_message) "
+              "VALUES (?, ?, ?, ?, ?, ?, ?)")
+    COMPLETE = "UPDATE requests SET status = ?, latency_ms = ?, response_body = ? WHERE id = ?"
+    COLUMNS = "id, ts, endpoint, model, api_key, status, latency_ms, request_body, response_body"
+    
+    def __init__(self, path: str, max_queue: int = 10000, flush_interval: float = 0.5,
+                 log_path: str = 'request_log.json', rebuild: bool = False):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.log_path = log_path  # Request log the store catches up with on start
+        self.rebuild = rebuild  # Re-ingest the whole request log instead of only newer records
+        self.ingested = 0
+        self.written = 0
+        self.dropped = 0
+        self._queue = Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+    
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="request-store-writer", daemon=True)
+                self._thread.start()
+    
+    def add_request(self, record_id: str, timestamp: str, endpoint: str, model: Optional[str],
+                    api_key: Optional[str], request_body: str, last_message: Optional[str] = None) -> bool:
+        """Queue a new request row; status, latency and response are filled in by complete_request"""
+        return self._put((self.INSERT, (record_id, timestamp, endpoint, model, api_key, request_body,
+                                        last_message)))
+    
+    def complete_request(self, record_id: str, status: int, latency_ms: float,
+                         response_body: Optional[str]) -> bool:
+        return self._put((self.COMPLETE, (status, latency_ms, response_body, record_id)))
+    
+    def connect(self) -> sqlite3.Connection:
+        """Open a read connection; WAL mode lets readers run while the writer commits"""
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+    
+    def search(self, endpoint: Optional[str] = None, model: Optional[str] = None,
+               api_key: Optional[str] = None, status: Optional[int] = None,
+               since: Optional[str] = None, until: Optional[str] = None, text: Optional[str] = None,
+               cursor: Optional[tuple] = None, limit: int = 50) -> List[sqlite3.Row]:
+        """Newest-first page of requests matching the filters, starting after cursor (ts, id)"""
+        conditions, params = self._filters(endpoint, model, api_key, status, since, until)
+        if cursor:
+            # Keyset pagination: stays fast on deep pages, unlike OFFSET
+            conditions.append("(ts < ? OR (ts = ? AND id < ?))")
+            params.extend([cursor[0], cursor[0], cursor[1]])
+        
+        conn = self.connect()
+        try:
+            if text:
+                has_fts = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'requests_fts'").fetchone() is not None
+                if has_fts:
+                    conditions.append("rowid IN (SELECT rowid FROM requests_fts WHERE requests_fts MATCH ?)")
+                    params.append('"' + text.replace('"', '""') + '"')
+                else:
+                    conditions.append("last_user_message LIKE ? ESCAPE '\\'")
+                    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+                    params.append(f"%{escaped}%")
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            return conn.execute(
+                f"SELECT {self.COLUMNS} FROM requests {where} ORDER BY ts DESC, id DESC LIMIT ?",
+                params + [limit]
+            ).fetchall()
+        finally:
+            conn.close()
+    
+    def iter_rows(self, endpoint: Optional[str] = None, model: Optional[str] = None,
+                  since: Optional[str] = None, until: Optional[str] = None, page_size: int = 1000):
+        """Yield all matching requests oldest first, one keyset page at a time"""
+        conn = self.connect()
+        try:
+            after = None
+            while True:
+                conditions, params = self._filters(endpoint, model, None, None, since, until)
+                if after:
+                    conditions.append("(ts > ? OR (ts = ? AND id > ?))")
+                    params.extend([after[0], after[0], after[1]])
+                where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+                # Short queries instead of one long read, so the writer can keep checkpointing the WAL
+                rows = conn.execute(
+                    f"SELECT {self.COLUMNS} FROM requests {where} ORDER BY ts, id LIMIT ?",
+                    params + [page_size]
+                ).fetchall()
+                yield from rows
+                if len(rows) < page_size:
+                    return
+                after = (rows[-1]["ts"], rows[-1]["id"])
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def _filters(endpoint: Optional[str], model: Optional[str], api_key: Optional[str],
+                 status: Optional[int], since: Optional[str], until: Optional[str]) -> tuple:
+        conditions, params = [], []
+        for column, value in (("endpoint", endpoint), ("model", model), ("api_key", api_key), ("status", status)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if since:
+            conditions.append("ts >= ?")
+            params.append(since)
+        if until:
+            conditions.append("ts <= ?")
+            params.append(until)
+        return conditions, params
+    
+    def close(self):
+        """Commit queued rows and stop the writer thread"""
+        with self._start_lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "queued": self._queue.qsize(),
+            "ingested": self.ingested,
+            "written": self.written,
+            "dropped": self.dropped
+        }
+    
+    def _put(self, operation: tuple) -> bool:
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait(operation)
+            return True
+        except Full:
+            self.dropped += 1
+            return False
+    
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(self.SCHEMA)
+        # Databases created before last_user_message existed
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(requests)")}
+        backfill = self.rebuild
+        if "last_user_message" not in columns:
+            conn.execute("ALTER TABLE requests ADD COLUMN last_user_message TEXT")
+            backfill = True
+        has_fts = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'requests_fts'").fetchone() is not None
+        try:
+            conn.executescript(self.FTS_SCHEMA)
+        except sqlite3.OperationalError as e:
+            # SQLite built without FTS5; text search falls back to LIKE
+            logger.warning(f"Full-text search unavailable in request store: {e}")
+        else:
+            # The trigger only indexes new rows
+            backfill = backfill or not has_fts
+        if backfill:
+            self._backfill_search(conn)
+        return conn
+    
+    def _backfill_search(self, conn: sqlite3.Connection):
+        """Fill last_user_message for rows stored without it and rebuild the full-text index"""
+        last_rowid = 0
+        while True:
+            rows = conn.execute(
+                "SELECT rowid, request_body FROM requests WHERE last_user_message IS NULL AND rowid > ? "
+                "ORDER BY rowid LIMIT 10000", (last_rowid,)).fetchall()
+            if not rows:
+                break
+            last_rowid = rows[-1][0]
+            updates = []
+            for rowid, request_body in rows:
+                try:
+                    request_data = json.loads(request_body) if request_body else None
+                except ValueError:
+                    continue
+                message = last_user_message(request_data) if isinstance(request_data, dict) else None
+                if message is not None:
+                    updates.append((message, rowid))
+            with conn:
+                conn.executemany("UPDATE requests SET last_user_message = ? WHERE rowid = ?", updates)
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'requests_fts'").fetchone() is not None:
+            with conn:
+                conn.execute("INSERT INTO requests_fts (requests_fts) VALUES ('rebuild')")
+    
+    def _ingest_log(self, conn: sqlite3.Connection):
+        """Insert request log records that are not in the store yet, e.g. logged while it was disabled"""
+        since = None
+        if not self.rebuild:
+            since = conn.execute("SELECT max(ts) FROM requests").fetchone()[0]
+        batch = []
+        for line in iter_log_lines(self.log_path, since=since):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("event") == "summary":
+                continue
+            if record.get("event") == "response":
+                response_body = record.get("response")
+                if response_body is not None and not isinstance(response_body, str):
+                    # Blob store reference
+                    response_body = json.dumps(response_body)
+                batch.append((self.COMPLETE, (record.get("status"), record.get("latency_ms"),
+                                              response_body, record.get("id"))))
+                continue
+            request_data = record.get("request") or {}
+            model = request_data.get("model") if isinstance(request_data, dict) else None
+            # Records written before ids existed get a stable one, so re-ingesting never duplicates them
+            record_id = record.get("id") or hashlib.sha1(line.encode()).hexdigest()[:32]
+            batch.append((self.INSERT, (record_id, record.get("received") or record.get("timestamp", ""),
+                                        record.get("endpoint", ""),
+                                        str(model) if model is not None else None, None,
+                                        json.dumps(request_data), last_user_message(request_data))))
+            if len(batch) >= 10000:
+                self.ingested += self._write(conn, batch, count=False)
+                batch = []
+        if batch:
+            self.ingested += self._write(conn, batch, count=False)
+    
+    def _run(self):
+        try:
+            conn = self._open()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to open request store {self.path}: {e}")
+            return
+        try:
+            try:
+                self._ingest_log(conn)
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f"Failed to ingest {self.log_path} into request store: {e}")
+            while True:
+                stopping = self._stop.wait(self.flush_interval)
+                batch = []
+                try:
+                    while True:
+                        batch.append(self._queue.get_nowait())
+                except Empty:
+                    pass
+                if batch:
+                    try:
+                        self._write(conn, batch)
+                    except sqlite3.Error as e:
+                        logger.error(f"Failed to write {len(batch)} request store rows: {e}")
+                if stopping:
+                    return
+        finally:
+            conn.close()
+    
+    def _write(self, conn: sqlite3.Connection, batch: List[tuple], count: bool = True) -> int:
+        """Apply queued operations in one transaction and return the number of new rows"""
+        inserted = 0
+        # Consecutive operations of the same kind share one executemany
+        with conn:
+            for statement, group in itertools.groupby(batch, key=lambda operation: operation[0]):
+                cursor = conn.executemany(statement, [params for _, params in group])
+                if statement == self.INSERT:
+                    # rowcount skips ignored duplicates
+                    inserted += cursor.rowcount
+        if count:
+            self.written += inserted
+        return inserted
+
+# Optional SQLite copy of captured traffic (enabled with --request-store)
+request_store: Optional[RequestStore] = None
+
+def last_user_message(request_data: Dict[str, Any], max_length: int = 4000) -> Optional[str]:
+    """Text of the last user message (or the prompt / first embedding input) for searching"""
+    if not isinstance(request_data, dict):
+        return None
+    content = None
+    if isinstance(request_data.get("messages"), list):
+        for message in reversed(request_data["messages"]):
+            if isinstance(message, dict) and message.get("role") == "user":
+                content = message.get("content")
+                break
+    elif "prompt" in request_data:
+        content = request_data["prompt"]
+    elif "input" in request_data:
+        content = request_data["input"]
+    
+    if isinstance(content, list):
+        # Text blocks of multimodal content, or the first prompt / embedding input
+        texts = [item.get("text", "") for item in content if isinstance(item, dict) and item.get("type") == "text"]
+        if not texts and content and isinstance(content[0], str):
+            texts = [content[0]]
+        content = "\n".join(texts)
+    if not isinstance(content, str):
+        return None
+    return content[:max_length]
+
+def api_key_fingerprint(http_request: Optional[Request]) -> Optional[str]:
+    """Short, non-reversible identifier of the API key a client sent"""
+    if http_request is None:
+        return None
+    authorization = http_request.headers.get("authorization", "")
+    key = authorization[7:] if authorization.lower().startswith("bearer ") else http_request.headers.get("x-api-key")
+    if not key:
+        return None
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+class BlobStore:
+    """Content-addressed directory of large payloads, each stored once under its SHA-256"""
+    
+    def __init__(self, root: str, min_bytes: int = 4096):
+        self.root = root
+        self.min_bytes = min_bytes  # Strings at least this long are replaced by references
+        self.stored = 0
+        self.deduplicated = 0
+        self.bytes_deduplicated = 0
+        self._known = set()
+        # put() runs on the log writer thread and, for web UI messages, on worker threads
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+    
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:])
+    
+    def put(self, data: bytes) -> str:
+        """Store data unless a blob with the same content exists and return its digest"""
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            known = digest in self._known
+        if not known:
+            path = self.path(digest)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+                with open(temp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+                with self._lock:
+                    self.stored += 1
+                    self._known.add(digest)
+                return digest
+            with self._lock:
+                self._known.add(digest)
+        with self._lock:
+            self.deduplicated += 1
+            self.bytes_deduplicated += len(data)
+        return digest
+    
+    def reference(self, value: str) -> Optional[Dict[str, Any]]:
+        """Reference to value in the store, or None if it is too short to be worth one"""
+        if len(value) < self.min_bytes:
+            return None
+        data = value.encode('utf-8')
+        return {"$blob": self.put(data), "bytes": len(data)}
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.root,
+            "min_bytes": self.min_bytes,
+            "stored": self.stored,
+            "deduplicated": self.deduplicated,
+            "bytes_deduplicated": self.bytes_deduplicated
+        }
+
+# Optional content-addressed store for large strings in logs and web UI messages (enabled with --blob-store)
+blob_store: Optional[BlobStore] = None
+
+def with_blob_references(value: Any) -> Any:
+    """Copy of value with large strings replaced by blob store references"""
+    if isinstance(value, str):
+        return blob_store.reference(value) or value
+    if isinstance(value, dict):
+        return {key: with_blob_references(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [with_blob_references(item) for item in value]
+    return value
+
+# Base64 payloads longer than this are truncated in logs
+LOG_BASE64_PREVIEW = 30
+
+def truncate_base64(value: str) -> str:
+    """Shorten a base64 payload, keeping the first few characters for identification"""
+    if len(value) > LOG_BASE64_PREVIEW:
+        return value[:LOG_BASE64_PREVIEW] + "... (truncated)"
+    return value
+
+def truncate_data_url(url: str) -> str:
+    """Shorten the base64 part of a data: URL, keeping its media type"""
+    # Only look for the marker near the start so huge payloads are never scanned
+    marker = url.find(";base64,", 0, 256)
+    if marker == -1:
+        return url
+    payload_start = marker + len(";base64,")
+    if len(url) - payload_start > LOG_BASE64_PREVIEW:
+        return url[:payload_start + LOG_BASE64_PREVIEW] + "... (truncated)"
+    return url
+
+def write_redacted_json(value: Any, parts: List[str], base64_source: bool = False):
+    """Append the JSON encoding of value to parts, truncating base64 payloads on the way"""
+    if isinstance(value, str):
+        reference = blob_store.reference(value) if blob_store is not None else None
+        if reference is not None:
+            # Kept in full in the blob store, once per distinct payload
+            write_redacted_json(reference, parts)
+            return
+        if value.startswith("data:"):
+            # OpenAI image_url / file data URLs, wherever they appear
+            value = truncate_data_url(value)
+        parts.append(encode_json_string(value))
+    elif isinstance(value, dict):
+        # Anthropic image/document sources: {"type": "base64", "media_type": ..., "data": ...}
+        is_base64_source = value.get("type") == "base64"
+        parts.append("{")
+        first = True
+        for key, item in value.items():
+            if not first:
+                parts.append(", ")
+            first = False
+            parts.append(encode_json_string(str(key)))
+            parts.append(": ")
+            if (is_base64_source and key == "data" and isinstance(item, str)
+                    and (blob_store is None or len(item) < blob_store.min_bytes)):
+                parts.append(encode_json_string(truncate_base64(item)))
+            else:
+                write_redacted_json(item, parts)
+        parts.append("}")
+    elif isinstance(value, (list, tuple)):
+        parts.append("[")
+        for index, item in enumerate(value):
+            if index:
+                parts.append(", ")
+            write_redacted_json(item, parts)
+        parts.append("]")
+    elif value is None or isinstance(value, (bool, int, float)):
+        parts.append(json.dumps(value))
+    else:
+        parts.append(encode_json_string(str(value)))
+
+def redacted_json(value: Any) -> str:
+    """Serialize request data for logging without copying it, truncating base64 payloads"""
+    parts = []
+    write_redacted_json(value, parts)
+    return "".join(parts)
+
+class Metrics:
+    """In-process counters and histograms, rendered in the Prometheus text format"""
+    
+    # Seconds; responders can be humans, so the latency buckets reach several minutes
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+    SERIALIZATION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+    
+    DESCRIPTIONS = {
+        "dummy_ai_requests_total": ("counter", "API requests by endpoint, model and status"),
+        "dummy_ai_response_bytes_total": ("counter", "Response body bytes sent, including streamed responses"),
+        "dummy_ai_tokens_total": ("counter", "Approximate prompt and completion tokens"),
+        "dummy_ai_request_duration_seconds": ("histogram", "Time from request to the last byte of the response"),
+        "dummy_ai_responder_wait_seconds": ("histogram", "Time spent waiting for the CLI or web UI responder"),
+        "dummy_ai_serialization_seconds": ("histogram", "Time spent encoding non-streamed response bodies"),
+    }
+    
+    def __init__(self):
+        self.in_flight = 0
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self._buckets = {}  # name -> bucket upper bounds
+    
+    def inc(self, name: str, labels: tuple, value: float = 1):
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+    
+    def observe(self, name: str, labels: tuple, value: float, buckets: tuple = LATENCY_BUCKETS):
+        key = (name, labels)
+        series = self._histograms.get(key)
+        if series is None:
+            self._buckets[name] = buckets
+            series = self._histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+        # Non-cumulative counts; render() accumulates them
+        series[bisect.bisect_left(buckets, value)] += 1
+        series[-1] += value
+    
+    @staticmethod
+    def model_label(model: str) -> str:
+        """Model names come from clients, so only known models get their own series"""
+        if not model:
+            return ""
+        if any(entry["id"] == model for entry in AVAILABLE_MODELS):
+            return model
+        if any(model in profile.models for profile in latency_profiles.values()):
+            return model
+        if response_rules is not None and model in response_rules.models:
+            return model
+        return "other"
+    
+    def record_request(self, endpoint: str, model: str, status: int, seconds: float, sent_bytes: int,
+                       usage: Optional[Dict[str, int]]):
+        model = self.model_label(model)
+        self.inc("dummy_ai_requests_total", (("endpoint", endpoint), ("model", model), ("status", str(status))))
+        self.inc("dummy_ai_response_bytes_total", (("endpoint", endpoint),), sent_bytes)
+        self.observe("dummy_ai_request_duration_seconds", (("endpoint", endpoint),), seconds)
+        if usage:
+            for kind in ("prompt", "completion"):
+                tokens = usage.get(f"{kind}_tokens", 0)
+                if tokens:
+                    self.inc("dummy_ai_tokens_total", (("endpoint", endpoint), ("model", model), ("type", kind)), tokens)
+    
+    @staticmethod
+    def _labels(labels: tuple, extra: str = "") -> str:
+        parts = [f'{key}="{value}"' for key, value in
+                 ((key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                  for key, value in labels)]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+    
+    def render(self, gauges: Dict[str, tuple]) -> str:
+        """Text exposition of all series plus the given gauges ({name: (help, value)})"""
+        lines = []
+        for name, (help_text, value) in gauges.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        
+        for name, (metric_type, help_text) in self.DESCRIPTIONS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            if metric_type == "counter":
+                for (series_name, labels), value in self._counters.items():
+                    if series_name == name:
+                        lines.append(f"{name}{self._labels(labels)} {value}")
+                continue
+            buckets = self._buckets.get(name, ())
+            for (series_name, labels), series in self._histograms.items():
+                if series_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets, series):
+                    cumulative += count
+                    le = self._labels(labels, f'le="{bound}"')
+                    lines.append(f"{name}_bucket{le} {cumulative}")
+                cumulative += series[len(buckets)]
+                le = self._labels(labels, 'le="+Inf"')
+                lines.append(f"{name}_bucket{le} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(labels)} {series[-1]}")
+                lines.append(f"{name}_count{self._labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+class LogSampler:
+    """Decides which requests are logged in full when there is too much traffic to log everything"""
+    
+    def __init__(self, every: int = 1, rate: float = 0, always: Optional[str] = None,
+                 slow_ms: float = 1000, summary_interval: float = 60):
+        self.every = every  # Log 1 in this many requests per endpoint
+        self.rate = rate  # Log at most this many requests per second per endpoint (0 disables)
+        self.always = re.compile(always) if always else None  # Matched against model and last user message
+        self.slow_ms = slow_ms  # Requests at least this slow are always logged (0 disables)
+        self.summary_interval = summary_interval
+        self._counters = {}
+        self._buckets = {}
+        self._skipped = {}
+        self._summary_started = time.time()
+        self.skipped = 0
+    
+    def should_log(self, endpoint: str, request_data: Dict[str, Any]) -> bool:
+        """Whether to log a request as soon as it arrives"""
+        if self.always is not None:
+            text = f"{request_data.get('model', '')}\n{last_user_message(request_data) or ''}"
+            if self.always.search(text):
+                return True
+        if self.every > 1:
+            count = self._counters.get(endpoint, 0)
+            self._counters[endpoint] = count + 1
+            if count % self.every:
+                return False
+        if self.rate > 0:
+            # Token bucket holding up to one second of records
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(endpoint, (self.rate, now))
+            tokens = min(self.rate, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[endpoint] = (tokens, now)
+                return False
+            self._buckets[endpoint] = (tokens - 1, now)
+        return True
+    
+    def keep_outcome(self, status: int, latency_ms: float) -> bool:
+        """Whether a request that was not sampled is logged anyway once its response is known"""
+        return status >= 400 or (self.slow_ms > 0 and latency_ms >= self.slow_ms)
+    
+    def record_skipped(self, endpoint: str, latency_ms: float, usage: Optional[Dict[str, int]]):
+        totals = self._skipped.setdefault(endpoint, {
+            "skipped": 0, "latency_ms_sum": 0.0, "latency_ms_max": 0.0, "prompt_tokens": 0, "completion_tokens": 0
+        })
+        totals["skipped"] += 1
+        self.skipped += 1
+        totals["latency_ms_sum"] += latency_ms
+        totals["latency_ms_max"] = max(totals["latency_ms_max"], latency_ms)
+        if usage:
+            totals["prompt_tokens"] += usage.get("prompt_tokens", 0)
+            totals["completion_tokens"] += usage.get("completion_tokens", 0)
+        self.flush_if_due()
+    
+    def flush_if_due(self):
+        """Write the summary once the summary interval has passed (also called by a timer)"""
+        if time.time() - self._summary_started >= self.summary_interval:
+            self.flush()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "every": self.every,
+            "rate": self.rate,
+            "slow_ms": self.slow_ms,
+            "skipped": self.skipped
+        }
+    
+    def flush(self):
+        """Write a summary record for requests skipped since the last one"""
+        started, self._summary_started = self._summary_started, time.time()
+        if not self._skipped:
+            return
+        skipped, self._skipped = self._skipped, {}
+        endpoints = {}
+        for endpoint, totals in skipped.items():
+            endpoints[endpoint] = {
+                "skipped": totals["skipped"],
+                "latency_ms_avg": round(totals["latency_ms_sum"] / totals["skipped"], 3),
+                "latency_ms_max": totals["latency_ms_max"],
+                "prompt_tokens": totals["prompt_tokens"],
+                "completion_tokens": totals["completion_tokens"]
+            }
+        request_log_writer.submit_nowait(
+            f'{{"timestamp": {encode_json_string(datetime.now().isoformat())}, '
+            f'"event": "summary", '
+            f'"since": {encode_json_string(datetime.fromtimestamp(started).isoformat())}, '
+            f'"endpoints": {json.dumps(endpoints)}}}'
+        )
+
+# Optional sampling of request logs (enabled with --log-sample / --log-rate-limit)
+log_sampler: Optional[LogSampler] = None
+
+async def log_request(endpoint: str, request_data: Dict[str, Any], http_request: Optional[Request] = None):
+    """Log the incoming request details, truncating base64 data in logs."""
+    record_id = uuid.uuid4().hex
+    timestamp = datetime.now().isoformat()
+    if http_request is not None:
+        # Picked up by record_request_outcome once the response has been sent
+        http_request.state.request_record_id = record_id
+        http_request.state.endpoint = endpoint
+        http_request.state.model = str(request_data.get("model", ""))
+    
+    if log_sampler is not None and not log_sampler.should_log(endpoint, request_data):
+        if http_request is None:
+            log_sampler.record_skipped(endpoint, 0.0, None)
+            return
+        # Not serialized unless the outcome makes it worth logging (see log_response)
+        http_request.state.deferred_log = (timestamp, endpoint, request_data, api_key_fingerprint(http_request))
+        return
+    
+    # Serializing (including blob store writes), printing and writing happen on the log writer thread
+    await request_log_writer.submit(functools.partial(
+        write_request_record, record_id, timestamp, endpoint, request_data, api_key_fingerprint(http_request)
+    ))
+
+def write_request_record(record_id: str, timestamp: str, endpoint: str, request_data: Dict[str, Any],
+                         api_key: Optional[str], received: Optional[str] = None) -> str:
+    """Serialize a request log line and add the request to the request store"""
+    # Serialize straight from the original request; base64 payloads are cut while walking it
+    request_json = redacted_json(request_data)
+    if request_store is not None:
+        model = request_data.get("model")
+        request_store.add_request(record_id, received or timestamp, endpoint,
+                                  str(model) if model is not None else None,
+                                  api_key, request_json, last_user_message(request_data))
+    # Records logged after their response keep the arrival time separately, so the log stays
+    # in timestamp order for time-range reads and segment indexes
+    received_field = f'"received": {encode_json_string(received)}, ' if received else ''
+    return (
+        f'{{"timestamp": {encode_json_string(timestamp)}, '
+        f'"id": "{record_id}", '
+        f'{received_field}'
+        f'"endpoint": {encode_json_string(endpoint)}, '
+        f'"request": {request_json}}}'
+    )
+
+def is_event_record(line: str) -> bool:
+    """Whether a JSON log line is a response or summary record rather than a request"""
+    # The event field directly follows the timestamp (and id)
+    return line.find('"event": "', 0, 120) != -1
+
+def log_response(record_id: str, status: int, latency_ms: float, usage: Optional[Dict[str, int]],
+                 response_body: Optional[str], deferred: Optional[tuple] = None):
+    """Append the outcome of a logged request to the request log and the request store"""
+    if deferred is not None:
+        timestamp, endpoint, request_data, api_key = deferred
+        if not log_sampler.keep_outcome(status, latency_ms):
+            log_sampler.record_skipped(endpoint, latency_ms, usage)
+            return
+        # Errors and slow requests are logged even when sampling skipped them
+        request_log_writer.submit_nowait(functools.partial(
+            write_request_record, record_id, datetime.now().isoformat(), endpoint, request_data, api_key,
+            received=timestamp
+        ))
+    
+    # Never waits: this runs after the response, possibly while the client disconnects
+    request_log_writer.submit_nowait(functools.partial(
+        write_response_record, record_id, datetime.now().isoformat(), status, latency_ms, usage, response_body
+    ))
+
+def write_response_record(record_id: str, timestamp: str, status: int, latency_ms: float,
+                          usage: Optional[Dict[str, int]], response_body: Optional[str]) -> str:
+    """Serialize a response log line and complete the request in the request store"""
+    logged_response = response_body
+    if blob_store is not None and response_body is not None:
+        logged_response = blob_store.reference(response_body) or response_body
+    if request_store is not None:
+        # Queued after the request's own record, so the row exists by the time it is completed
+        request_store.complete_request(record_id, status, latency_ms, response_body)
+    return (
+        f'{{"timestamp": {encode_json_string(timestamp)}, '
+        f'"id": "{record_id}", '
+        f'"event": "response", '
+        f'"status": {status}, '
+        f'"latency_ms": {latency_ms}, '
+        f'"usage": {json.dumps(usage)}, '
+        f'"response": {json.dumps(logged_response)}}}'
+    )
+
+DEFAULT_RESPONSE = "Hello! I'm the AI assistant. How can I help you today?"
+
+# CLI responder state: terminal input is read on a dedicated thread and fed to
+# the event loop through an asyncio queue, so waiting for the operator never
+# blocks other requests.
+cli_pending = {}
+cli_request_counter = itertools.count(1)
+cli_input_queue: Optional[asyncio.Queue] = None
+cli_dispatcher_task: Optional[asyncio.Task] = None
+cli_input_closed = False  # Set once stdin reaches EOF; later CLI requests fail immediately
+
+def cli_stdin_reader(loop: asyncio.AbstractEventLoop, queue: asyncio.Queue):
+    """Read terminal lines on a background thread and hand them to the event loop"""
+    for line in sys.stdin:
+        loop.call_soon_threadsafe(queue.put_nowait, line.rstrip('\n'))
+    # Signal EOF so pending requests can be failed instead of hanging forever
+    loop.call_soon_threadsafe(queue.put_nowait, None)
+
+async def next_cli_line() -> str:
+    """Wait for the next line typed in the terminal"""
+    line = await cli_input_queue.get()
+    if line is None:
+        raise EOFError("stdin closed")
+    return line
+
+def print_cli_request(request_id: str, entry: Dict[str, Any]):
+    """Print a pending request together with the instructions to answer it"""
     print("\n" + "="*80)
-    print("INTERCEPTED REQUEST - Please provide response")
+    if entry["kind"] == "embedding":
+        print(f"INTERCEPTED EMBEDDING REQUEST [{request_id}] - Please choose response type")
+    else:
+        print(f"INTERCEPTED REQUEST [{request_id}] - Please provide response")
     print("="*80)
-    print(prompt_info)
+    print(entry["prompt_info"])
     print("\n" + "-"*80)
-    print("Enter your response (type 'END' on a new line when done):")
-    print("Or press ENTER to use default message: 'Hello! I'm the AI assistant. How can I help you today?'")
-    
+    if entry["kind"] == "embedding":
+        print("Choose embedding response type:")
+        print("1. Random normalized (default)")
+        print("2. Zero vector")
+        print("3. Sequential pattern")
+        print("4. Hash-based (deterministic)")
+        print("5. From file")
+        print("6. Custom JSON")
+        print("7. Clustered (K centroids, deterministic per text)")
+        print("\nEnter choice [1-7] or press ENTER for default:")
+    else:
+        print("Enter your response (type 'END' on a new line when done):")
+        print(f"Or press ENTER to use default message: '{DEFAULT_RESPONSE}'")
+    print_cli_pending_hint()
+
+def print_cli_pending_hint():
+    """Explain how to pick a request when several are waiting"""
+    if len(cli_pending) > 1:
+        print(f"\n{len(cli_pending)} requests pending: {', '.join(cli_pending)}")
+        print("Type a request ID to answer it, 'list' to show all, 'show <id>' for details.")
+
+def print_cli_pending():
+    """List all requests waiting for a CLI response"""
+    if not cli_pending:
+        print("No pending requests.")
+        return
+    print("\nPending requests:")
+    for request_id, entry in cli_pending.items():
+        first_line = entry["prompt_info"].split("\n", 1)[0]
+        waiting = time.time() - entry["created"]
+        print(f"  {request_id:<6} {entry['kind']:<10} {first_line} (waiting {waiting:.0f}s)")
+
+async def read_cli_text_response(first_line: Optional[str] = None) -> str:
+    """Read a multi-line text response terminated by END"""
     lines = []
-    first_line = True
-    while True:
-        line = input()
-        if first_line and line.strip() == '':
-            # User pressed enter immediately - use default message
-            return "Hello! I'm the AI assistant. How can I help you today?"
-        first_line = False
-        if line.strip() == 'END':
-            break
+    line = first_line if first_line is not None else await next_cli_line()
+    if line.strip() == '':
+        # User pressed enter immediately - use default message
+        return DEFAULT_RESPONSE
+    while line.strip() != 'END':
         lines.append(line)
+        line = await next_cli_line()
     
     return '\n'.join(lines)
 
-def get_cli_embedding_response(prompt_info: str, dimensions: int) -> Dict[str, Any]:
-    """Get embedding response choice from user via terminal"""
-    print("\n" + "="*80)
-    print("INTERCEPTED EMBEDDING REQUEST - Please choose response type")
-    print("="*80)
-    print(prompt_info)
-    print("\n" + "-"*80)
-    print("Choose embedding response type:")
-    print("1. Random normalized (default)")
-    print("2. Zero vector")
-    print("3. Sequential pattern")
-    print("4. Hash-based (deterministic)")
-    print("5. From file")
-    print("6. Custom JSON")
-    print("\nEnter choice [1-6] or press ENTER for default:")
-    
-    choice = input().strip()
+async def read_cli_embedding_choice(first_line: Optional[str] = None) -> Dict[str, Any]:
+    """Read an embedding response choice"""
+    choice = (first_line if first_line is not None else await next_cli_line()).strip()
     if not choice:
         choice = "1"
     
@@ -285,13 +1573,13 @@ def get_cli_embedding_response(prompt_info: str, dimensions: int) -> Dict[str, A
         return {"type": "hash"}
     elif choice == "5":
         print("Enter filepath (relative to current directory):")
-        filepath = input().strip()
+        filepath = (await next_cli_line()).strip()
         return {"type": "file", "filepath": filepath}
     elif choice == "6":
         print("Enter custom embedding JSON (or 'END' on new line when done):")
         lines = []
         while True:
-            line = input()
+            line = await next_cli_line()
             if line.strip() == 'END':
                 break
             lines.append(line)
@@ -301,9 +1589,109 @@ def get_cli_embedding_response(prompt_info: str, dimensions: int) -> Dict[str, A
         except json.JSONDecodeError:
             print("Invalid JSON, using random instead")
             return {"type": "random"}
+    elif choice == "7":
+        print(f"Number of clusters, 1-{MAX_EMBEDDING_CLUSTERS} [16]:")
+        clusters = (await next_cli_line()).strip() or "16"
+        print("Similarity to centroid, 0-1 [0.9]:")
+        similarity = (await next_cli_line()).strip() or "0.9"
+        try:
+            clustered = {"type": "clustered", "clusters": int(clusters), "similarity": float(similarity)}
+            clustered_settings(clustered)
+            return clustered
+        except ValueError as e:
+            print(f"Invalid value ({e}), using defaults")
+            return {"type": "clustered"}
     else:
         return {"type": "random"}
 
+async def cli_dispatcher():
+    """Route terminal input to pending requests, one answer at a time"""
+    global cli_input_closed
+    while True:
+        try:
+            line = await next_cli_line()
+        except EOFError:
+            cli_input_closed = True
+            for entry in cli_pending.values():
+                if not entry["future"].done():
+                    entry["future"].set_exception(RuntimeError("CLI input closed"))
+            cli_pending.clear()
+            return
+        
+        command = line.strip()
+        if command in ("list", "ls"):
+            print_cli_pending()
+            continue
+        if command.startswith("show "):
+            request_id = command[5:].strip()
+            if request_id in cli_pending:
+                print_cli_request(request_id, cli_pending[request_id])
+            else:
+                print(f"Unknown request ID: {request_id}")
+            continue
+        
+        if command in cli_pending:
+            # Explicit selection - the answer starts on the next line
+            request_id = command
+            first_line = None
+            print_cli_request(request_id, cli_pending[request_id])
+        elif len(cli_pending) == 1:
+            # Only one request waiting - treat the line as the start of its answer
+            request_id = next(iter(cli_pending))
+            first_line = line
+        elif not cli_pending:
+            print("No pending requests.")
+            continue
+        else:
+            print(f"Several requests are pending ({', '.join(cli_pending)}). Type a request ID first, or 'list'.")
+            continue
+        
+        entry = cli_pending[request_id]
+        try:
+            if entry["kind"] == "embedding":
+                answer = await read_cli_embedding_choice(first_line)
+            else:
+                answer = await read_cli_text_response(first_line)
+        except EOFError:
+            cli_input_queue.put_nowait(None)
+            continue
+        
+        cli_pending.pop(request_id, None)
+        if not entry["future"].done():
+            entry["future"].set_result(answer)
+            print(f"Response sent for request {request_id}.")
+        else:
+            print(f"Request {request_id} was cancelled by the client; response discarded.")
+        print_cli_pending_hint()
+
+async def wait_for_cli_answer(kind: str, prompt_info: str) -> Any:
+    """Queue a request for the CLI operator and wait for the answer"""
+    if cli_input_closed:
+        raise RuntimeError("CLI input closed")
+    request_id = f"r{next(cli_request_counter)}"
+    entry = {
+        "kind": kind,
+        "prompt_info": prompt_info,
+        "created": time.time(),
+        "future": asyncio.get_running_loop().create_future()
+    }
+    cli_pending[request_id] = entry
+    print_cli_request(request_id, entry)
+    
+    try:
+        return await entry["future"]
+    finally:
+        # Drop requests whose client went away before being answered
+        cli_pending.pop(request_id, None)
+
+async def get_cli_response(prompt_info: str) -> str:
+    """Get response from user via terminal"""
+    return await wait_for_cli_answer("text", prompt_info)
+
+async def get_cli_embedding_response(prompt_info: str, dimensions: int) -> Dict[str, Any]:
+    """Get embedding response choice from user via terminal"""
+    return await wait_for_cli_answer("embedding", prompt_info)
+
 async def get_web_response(request_id: str, request_data: Dict[str, Any], raw_request: Optional[str] = None) -> Dict[str, Any]:
     """Get response from web UI"""
     # Store request in pending
@@ -314,21 +1702,29 @@ async def get_web_response(request_id: str, request_data: Dict[str, Any], raw_re
         "raw_request": raw_request  # Include raw request if available
     }
     
+    # Large payloads are sent as blob references, which the UI fetches once per digest;
+    # hashing and storing them happens off the event loop
+    data = request_data["data"]
+    if blob_store is not None:
+        data = await asyncio.to_thread(with_blob_references, data)
+    
     # Notify all connected WebSocket clients
     message = {
         "type": "new_request",
         "request": {
             "id": request_id,
             "endpoint": request_data["endpoint"],
-            "data": request_data["data"],
+            "data": data,
             "raw_request": raw_request  # Include raw request if available
         }
     }
+    # Encode once for all clients
+    message_text = json.dumps(message)
     
     disconnected_clients = []
     for client in websocket_clients:
         try:
-            await client.send_json(message)
+            await client.send_text(message_text)
         except:
             disconnected_clients.append(client)
     
@@ -348,37 +1744,523 @@ def count_tokens(text: str) -> int:
     """Simple token counter (approximation)"""
     return int(len(text.split()) * 1.3)  # Rough approximation
 
-def generate_random_embedding(dimensions: int) -> List[float]:
-    """Generate a random normalized embedding vector"""
-    embedding = np.random.randn(dimensions)
-    embedding = embedding / np.linalg.norm(embedding)
-    return embedding.tolist()
+def parse_length_distribution(spec: str):
+    """Parse an output length distribution: fixed:N, uniform:MIN:MAX, normal:MEAN:STDDEV,
+    lognormal:MEDIAN:SIGMA, exponential:MEAN or max_tokens (use the request's max_tokens)"""
+    name, _, params = spec.partition(":")
+    try:
+        values = [float(value) for value in params.split(":")] if params else []
+    except ValueError:
+        raise ValueError(f"invalid length distribution {spec!r}")
+    samplers = {
+        "fixed": (1, lambda n: n),
+        "uniform": (2, lambda low, high: random.uniform(low, high)),
+        "normal": (2, lambda mean, stddev: random.gauss(mean, stddev)),
+        "lognormal": (2, lambda median, sigma: random.lognormvariate(math.log(median), sigma)),
+        "exponential": (1, lambda mean: random.expovariate(1 / mean)),
+        "max_tokens": (0, None)
+    }
+    if name not in samplers or len(values) != samplers[name][0]:
+        raise ValueError(f"invalid length distribution {spec!r}")
+    sampler = samplers[name][1]
+    if sampler is None:
+        return None
+    if name in ("lognormal", "exponential") and values[0] <= 0:
+        raise ValueError(f"invalid length distribution {spec!r}")
+    return lambda: sampler(*values)
+
+class SyntheticResponder:
+    """Answers on its own with text of a sampled length, sliced out of a precomputed word buffer"""
+    
+    VOCABULARY = (
+        "the of and to a in is that for it as with was on be by this are or from at an which but not have "
+        "has can will more one all their there been if would about when so what into some other than then "
+        "these its only also time could new two may first way each after most over such make like through "
+        "data model system value request response server client token stream result number example test "
+        "output input function method process state error message field type list table query network "
+        "memory cache latency request. response. result, example, however, therefore, finally. instead, "
+        "simple fast large small early later often usually quickly carefully directly mostly"
+    ).split()
+    # count_tokens() counts 1.3 tokens per word
+    TOKENS_PER_WORD = 1.3
+    
+    def __init__(self, length: str = "lognormal:200:0.6", default_tokens: int = 256,
+                 buffer_words: int = 1 << 18, seed: int = 0):
+        self.length = length
+        self.sample_length = parse_length_distribution(length)
+        self.default_tokens = default_tokens
+        self.generated = 0
+        words = random.Random(seed).choices(self.VOCABULARY, k=buffer_words)
+        self.buffer = " ".join(words)
+        # Start offset of every word, plus the end of the buffer (past the last word's separator)
+        self.offsets = [0, *itertools.accumulate(len(word) + 1 for word in words)]
+    
+    def tokens(self, request_data: Dict[str, Any]) -> int:
+        """Output length for a request; max_tokens is always respected"""
+        max_tokens = request_data.get("max_tokens")
+        if self.sample_length is None:
+            return max_tokens or self.default_tokens
+        tokens = max(1, int(self.sample_length()))
+        return min(tokens, max_tokens) if max_tokens else tokens
+    
+    def text(self, tokens: int) -> str:
+        """Text of about `tokens` tokens, as counted by count_tokens()"""
+        remaining = max(1, round(tokens / self.TOKENS_PER_WORD))
+        word_count = len(self.offsets) - 1
+        pieces = []
+        while remaining > 0:
+            take = min(remaining, word_count)
+            start = random.randrange(word_count - take + 1)
+            pieces.append(self.buffer[self.offsets[start]:self.offsets[start + take] - 1])
+            remaining -= take
+        self.generated += 1
+        return " ".join(pieces)
+    
+    def answer(self, request_data: Dict[str, Any]) -> str:
+        return self.text(self.tokens(request_data))
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "length": self.length,
+            "buffer_bytes": len(self.buffer),
+            "generated": self.generated
+        }
+
+# Generates responses in synthetic mode (--mode synthetic)
+synthetic_responder: Optional[SyntheticResponder] = None
+
+class TimerWheel:
+    """Shared timer for stream pacing: sleepers are bucketed by tick and woken together by one task,
+    instead of each stream scheduling its own timer on the event loop"""
+    
+    def __init__(self, resolution: float = 0.002, slots: int = 4096):
+        self.resolution = resolution
+        self.slots = [[] for _ in range(slots)]
+        self.pending = 0
+        self._current = 0  # last tick the driver has woken sleepers for
+        self._task = None
+    
+    async def sleep_until(self, when: float):
+        """Sleep until `when` on the event loop clock (loop.time())"""
+        loop = asyncio.get_running_loop()
+        if when <= loop.time():
+            return
+        future = loop.create_future()
+        tick = math.ceil(when / self.resolution)
+        self.slots[tick % len(self.slots)].append((tick, future))
+        self.pending += 1
+        if self._task is None:
+            self._current = tick - 1
+            self._task = loop.create_task(self._run())
+        elif tick <= self._current:
+            # Added before the driver's first pass; make sure that pass scans this tick
+            self._current = tick - 1
+        await future
+    
+    async def sleep(self, delay: float):
+        await self.sleep_until(asyncio.get_running_loop().time() + delay)
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self.pending:
+                await asyncio.sleep(max(0.0, (self._current + 1) * self.resolution - loop.time()))
+                current = self._current
+                now = math.floor(loop.time() / self.resolution)
+                # Every slot at most once, even if the loop was blocked for a whole turn of the wheel
+                for tick in range(current + 1, min(now, current + len(self.slots)) + 1):
+                    slot = self.slots[tick % len(self.slots)]
+                    if not slot:
+                        continue
+                    waiting = []
+                    for entry in slot:
+                        if entry[0] > now:
+                            waiting.append(entry)
+                            continue
+                        self.pending -= 1
+                        if not entry[1].done():
+                            entry[1].set_result(None)
+                    self.slots[tick % len(self.slots)] = waiting
+                self._current = max(now, current)
+        finally:
+            self._task = None
+
+# Paces all streamed responses
+timer_wheel = TimerWheel()
+
+class LatencyProfile:
+    """Streaming timing: time to first token, tokens per second, jitter and occasional stalls"""
+    
+    def __init__(self, name: str, ttft_ms: float = 0.0, tokens_per_second: float = 0.0, jitter: float = 0.0,
+                 stall_probability: float = 0.0, stall_ms: float = 0.0, models: Optional[List[str]] = None):
+        self.name = name
+        self.ttft_ms = ttft_ms
+        self.tokens_per_second = tokens_per_second  # 0 streams as fast as possible
+        self.jitter = jitter  # sigma of a log-normal factor (median 1) applied to every delay
+        self.stall_probability = stall_probability  # chance per chunk of an extra stall
+        self.stall_ms = stall_ms  # mean stall length (exponentially distributed)
+        self.models = models or []
+    
+    def _jittered(self, seconds: float) -> float:
+        return seconds * random.lognormvariate(0.0, self.jitter) if self.jitter > 0 and seconds > 0 else seconds
+    
+    def first_token_delay(self) -> float:
+        return self._jittered(self.ttft_ms / 1000)
+    
+    def chunk_delay(self, tokens: float) -> float:
+        """Time to generate a chunk of `tokens` tokens"""
+        delay = self._jittered(tokens / self.tokens_per_second) if self.tokens_per_second > 0 else 0.0
+        if self.stall_probability > 0 and random.random() < self.stall_probability:
+            delay += random.expovariate(1000 / self.stall_ms) if self.stall_ms > 0 else 0.0
+        return delay
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "ttft_ms": self.ttft_ms,
+            "tokens_per_second": self.tokens_per_second,
+            "jitter": self.jitter,
+            "stall_probability": self.stall_probability,
+            "stall_ms": self.stall_ms,
+            "models": self.models
+        }
+
+# "default" keeps the original pacing of one 3-word chunk (3.9 tokens) every 100ms
+latency_profiles = {
+    "default": LatencyProfile("default", tokens_per_second=39),
+    "instant": LatencyProfile("instant"),
+    "fast": LatencyProfile("fast", ttft_ms=250, tokens_per_second=120, jitter=0.2),
+    "typical": LatencyProfile("typical", ttft_ms=700, tokens_per_second=45, jitter=0.35,
+                              stall_probability=0.01, stall_ms=1500),
+    "slow": LatencyProfile("slow", ttft_ms=2500, tokens_per_second=12, jitter=0.5,
+                           stall_probability=0.03, stall_ms=4000),
+    "reasoning": LatencyProfile("reasoning", ttft_ms=15000, tokens_per_second=60, jitter=0.3),
+}
+# Profile used when neither the request header, a rule nor the model selects one (--latency-profile)
+default_latency_profile = "default"
+
+def load_latency_profiles(filepath: str):
+    """Add or replace latency profiles from a JSON object of name -> settings"""
+    with open(filepath, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError("expected an object of profile name -> settings")
+    for name, settings in data.items():
+        try:
+            latency_profiles[name] = LatencyProfile(name, **settings)
+        except TypeError as e:
+            raise ValueError(f"profile {name!r}: {e}")
+
+def select_latency_profile(http_request: Request, request_data: Dict[str, Any]) -> LatencyProfile:
+    """Latency profile from the X-Latency-Profile header, the matched rule or the model name"""
+    name = http_request.headers.get("x-latency-profile")
+    if name not in latency_profiles:
+        rule = getattr(http_request.state, "rule", None)
+        name = rule.get("latency_profile") if rule else None
+    if name not in latency_profiles:
+        model = request_data.get("model")
+        name = next((profile.name for profile in latency_profiles.values() if model in profile.models),
+                    default_latency_profile)
+    return latency_profiles.get(name, latency_profiles["default"])
+
+class StreamPacer:
+    """Paces the chunks of one streamed response on the shared timer wheel"""
+    
+    def __init__(self, profile: LatencyProfile, text: str = ""):
+        self.profile = profile
+        self.deadline = None
+        # The response's tokens (as count_tokens() counts them) are spread over its characters,
+        # so a stream takes as long however finely it is chunked
+        self.tokens_per_char = len(text.split()) * 1.3 / len(text) if text else 0.0
+    
+    async def wait(self, text: Optional[str] = None):
+        """Wait for the first token on the first call, then for the tokens of each chunk sent"""
+        loop = asyncio.get_running_loop()
+        if self.deadline is None:
+            self.deadline = loop.time() + self.profile.first_token_delay()
+        else:
+            # Deadlines add up, so time spent producing chunks doesn't slow the stream down
+            self.deadline += self.profile.chunk_delay(len(text) * self.tokens_per_char if text else 0.0)
+        await timer_wheel.sleep_until(self.deadline)
+
+# Approximate tokens: a word piece or a punctuation mark with its leading whitespace, or trailing
+# whitespace. Every character matches one of the alternatives, so joining the pieces gives the text back.
+APPROXIMATE_TOKEN_PATTERN = re.compile(r"\s*\w{1,6}|\s*[^\w\s]|\s+")
+# A word with the whitespace after it (or leading whitespace on its own)
+WORD_PATTERN = re.compile(r"\S+\s*|\s+")
+
+def chunk_utf8_bytes(text: str, size: int) -> List[str]:
+    """Chunks of at most `size` UTF-8 bytes, never splitting a character"""
+    data = text.encode("utf-8")
+    chunks = []
+    start = 0
+    while start < len(data):
+        end = min(start + size, len(data))
+        # Back off to a character boundary (continuation bytes are 0b10xxxxxx)
+        while end < len(data) and end > start and data[end] & 0xC0 == 0x80:
+            end -= 1
+        if end == start:
+            # A single character longer than `size`
+            end = start + 1
+            while end < len(data) and data[end] & 0xC0 == 0x80:
+                end += 1
+        chunks.append(data[start:end].decode("utf-8"))
+        start = end
+    return chunks
+
+def chunk_words(text: str, count: int) -> List[str]:
+    """Groups of `count` words, keeping the whitespace between them as it was"""
+    words = WORD_PATTERN.findall(text)
+    if len(words) > 1 and words[0].isspace():
+        # Leading whitespace goes with the first word
+        words[1] = words[0] + words[1]
+        del words[0]
+    return ["".join(words[i:i + count]) for i in range(0, len(words), count)]
+
+@functools.lru_cache(maxsize=32)
+def parse_stream_chunking(spec: str):
+    """Parse a chunking strategy: char, token, bytes:N, words:N or whole"""
+    name, _, param = spec.partition(":")
+    if name in ("char", "token", "whole") and not param:
+        if name == "char":
+            return list
+        if name == "token":
+            return APPROXIMATE_TOKEN_PATTERN.findall
+        return lambda text: [text] if text else []
+    if name in ("bytes", "words") and param.isdigit() and int(param) > 0:
+        size = int(param)
+        if name == "bytes":
+            return lambda text: chunk_utf8_bytes(text, size)
+        return lambda text: chunk_words(text, size)
+    raise ValueError(f"invalid chunking strategy {spec!r}; use char, token, bytes:N, words:N or whole")
+
+# Chunking used unless the X-Stream-Chunking header or a rule selects another (--stream-chunking)
+default_stream_chunking = "words:3"
+
+def stream_chunks(http_request: Request, text: str) -> List[str]:
+    """Split a response for streaming with the strategy from the X-Stream-Chunking header or the matched rule"""
+    rule = getattr(http_request.state, "rule", None)
+    for spec in (http_request.headers.get("x-stream-chunking"), rule.get("chunking") if rule else None):
+        if spec:
+            try:
+                return parse_stream_chunking(spec)(text)
+            except ValueError:
+                pass
+    return parse_stream_chunking(default_stream_chunking)(text)
+
+class EmbeddingCache:
+    """Bounded, thread-safe LRU cache of generated embedding vectors"""
+    
+    def __init__(self, maxsize: int, maxbytes: int = 0):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes  # 0 only limits the number of entries
+        self.hits = 0
+        self.misses = 0
+        self._vectors = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+    
+    def get(self, key: Any) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._vectors.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._vectors.move_to_end(key)
+            self.hits += 1
+            return vector
+    
+    def put(self, key: Any, vector: np.ndarray):
+        if self.maxsize <= 0:
+            return
+        # Keep a read-only copy so callers can't modify cached vectors
+        vector = vector.copy()
+        vector.setflags(write=False)
+        with self._lock:
+            previous = self._vectors.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+            self._vectors[key] = vector
+            self._bytes += vector.nbytes
+            while self._vectors and (len(self._vectors) > self.maxsize
+                                     or (self.maxbytes and self._bytes > self.maxbytes)):
+                self._bytes -= self._vectors.popitem(last=False)[1].nbytes
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._vectors),
+                "maxsize": self.maxsize,
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+class RandomEmbeddingPool:
+    """Ring buffer of pre-normalized random vectors, refilled on a background thread"""
+    
+    FILL_BLOCK_ROWS = 256
+    
+    def __init__(self, dimensions: int, capacity: int):
+        self.dimensions = dimensions
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._buffer = np.empty((capacity, dimensions))
+        self._head = 0  # Next row to hand out
+        self._count = 0  # Rows ready to hand out
+        self._lock = threading.Lock()
+        self._refill = threading.Event()
+        self._rng = np.random.default_rng()
+        self._refill.set()
+        threading.Thread(target=self._fill_loop, name=f"embedding-pool-{dimensions}", daemon=True).start()
+    
+    def take(self, count: int) -> Optional[np.ndarray]:
+        """Return count vectors from the pool, or None if not enough are ready"""
+        with self._lock:
+            if count > self._count:
+                self.misses += 1
+                self._refill.set()
+                return None
+            rows = self._buffer.take(np.arange(self._head, self._head + count) % self.capacity, axis=0)
+            self._head = (self._head + count) % self.capacity
+            self._count -= count
+            self.hits += 1
+            if self._count < self.capacity // 2:
+                self._refill.set()
+            return rows
+    
+    def _fill_loop(self):
+        while True:
+            self._refill.wait()
+            with self._lock:
+                free = self.capacity - self._count
+                if free == 0:
+                    self._refill.clear()
+                    continue
+            # Generate outside the lock so requests can keep taking vectors meanwhile
+            block = normalize_rows(self._rng.standard_normal((min(free, self.FILL_BLOCK_ROWS), self.dimensions)))
+            with self._lock:
+                # Free space only grows while we were generating, so the block still fits
+                tail = self._head + self._count
+                self._buffer[np.arange(tail, tail + len(block)) % self.capacity] = block
+                self._count += len(block)
+                if self._count == self.capacity:
+                    self._refill.clear()
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "ready": self._count,
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+# Shared generator for unseeded random embeddings (the global np.random state is never reseeded)
+random_rng = np.random.default_rng()
+embedding_cache = EmbeddingCache(4096)
+# Precomputed random vectors per dimension, only populated when --embedding-pool-size is set
+random_embedding_pools = {}
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Normalize every row of a matrix to unit length in place"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0  # Leave zero vectors untouched
+    matrix /= norms
+    return matrix
+
+def generate_random_embeddings(count: int, dimensions: int, seed: Optional[int] = None,
+                               rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """Generate a (count, dimensions) matrix of random normalized embeddings"""
+    if rng is None and seed is None and dimensions in random_embedding_pools:
+        rows = random_embedding_pools[dimensions].take(count)
+        if rows is not None:
+            return rows
+    if rng is None:
+        # A request seed makes the whole batch reproducible without touching shared state
+        rng = random_rng if seed is None else np.random.default_rng(seed % 2**64)
+    return normalize_rows(rng.standard_normal((count, dimensions)))
+
+def generate_zero_embeddings(count: int, dimensions: int) -> np.ndarray:
+    """Generate a (count, dimensions) matrix of zero embeddings"""
+    return np.zeros((count, dimensions))
+
+def generate_sequential_embeddings(count: int, dimensions: int) -> np.ndarray:
+    """Generate a (count, dimensions) matrix of sequential pattern embeddings"""
+    embedding = np.arange(dimensions) / 1000.0
+    embedding = embedding / np.linalg.norm(embedding)
+    # Every row is identical, so broadcast a single vector instead of copying it
+    return np.broadcast_to(embedding, (count, dimensions))
+
+def embedding_rng(text: str, dimensions: int, seed: Optional[int] = None) -> np.random.Generator:
+    """Create a random generator derived from (text hash, seed, dimensions)"""
+    digest = hashlib.sha256(text.encode()).digest()
+    entropy = [int.from_bytes(digest[:16], "little"), dimensions]
+    if seed is not None:
+        entropy += [1, seed % 2**64]
+    return np.random.default_rng(entropy)
+
+def generate_hash_based_embeddings(texts: List[str], dimensions: int, seed: Optional[int] = None) -> np.ndarray:
+    """Generate a matrix of deterministic embeddings based on text hashes"""
+    matrix = np.empty((len(texts), dimensions))
+    missing = {}
+    for i, text in enumerate(texts):
+        cached = embedding_cache.get((text, dimensions, seed))
+        if cached is not None:
+            matrix[i] = cached
+        else:
+            missing.setdefault(text, []).append(i)
+    
+    if missing:
+        # Generate each distinct missing text once and normalize them in one pass
+        block = np.empty((len(missing), dimensions))
+        for row, text in enumerate(missing):
+            block[row] = embedding_rng(text, dimensions, seed).standard_normal(dimensions)
+        normalize_rows(block)
+        for row, (text, positions) in enumerate(missing.items()):
+            matrix[positions] = block[row]
+            embedding_cache.put((text, dimensions, seed), block[row])
+    
+    return matrix
+
+# Upper bound for clustered mode; each centroid set is a (clusters, dimensions) matrix
+MAX_EMBEDDING_CLUSTERS = 4096
+# Model and seed come from clients, so centroid sets are cached by total size, not by count
+centroid_cache = EmbeddingCache(64, maxbytes=256 * 2**20)
 
-def generate_zero_embedding(dimensions: int) -> List[float]:
-    """Generate a zero embedding vector"""
-    return [0.0] * dimensions
+def cluster_centroids(model: str, dimensions: int, seed: Optional[int], clusters: int) -> np.ndarray:
+    """Generate the normalized centroids used by clustered mode, once per (model, dims, seed)"""
+    key = (model, dimensions, seed, clusters)
+    centroids = centroid_cache.get(key)
+    if centroids is None:
+        rng = embedding_rng(f"centroids:{model}:{clusters}", dimensions, seed)
+        centroids = normalize_rows(rng.standard_normal((clusters, dimensions)))
+        centroid_cache.put(key, centroids)
+    return centroids
 
-def generate_sequential_embedding(dimensions: int) -> List[float]:
-    """Generate a sequential pattern embedding"""
-    embedding = np.arange(dimensions) / 1000.0
-    embedding = embedding / np.linalg.norm(embedding)
-    return embedding.tolist()
-
-def generate_hash_based_embedding(text: str, dimensions: int) -> List[float]:
-    """Generate deterministic embedding based on text hash"""
-    # Create a hash of the text
-    text_hash = hashlib.sha256(text.encode()).hexdigest()
-    # Use the hash to seed the random generator for deterministic results
-    seed = int(text_hash[:8], 16)
-    np.random.seed(seed)
-    embedding = np.random.randn(dimensions)
-    embedding = embedding / np.linalg.norm(embedding)
-    return embedding.tolist()
+def clustered_settings(response_choice: Dict[str, Any]) -> tuple:
+    """Return (clusters, similarity) of a clustered embedding choice, raising ValueError if out of range"""
+    clusters = int(response_choice.get("clusters", 16))
+    similarity = float(response_choice.get("similarity", 0.9))
+    if not 1 <= clusters <= MAX_EMBEDDING_CLUSTERS:
+        raise ValueError(f"clusters must be between 1 and {MAX_EMBEDDING_CLUSTERS}")
+    return clusters, min(max(similarity, 0.0), 1.0)
+
+def generate_clustered_embeddings(texts: List[str], dimensions: int, model: str, seed: Optional[int] = None,
+                                  clusters: int = 16, similarity: float = 0.9) -> np.ndarray:
+    """Generate embeddings grouped around K centroids, each text assigned to one by hash"""
+    centroids = cluster_centroids(model, dimensions, seed, clusters)
+    assignment = np.fromiter((embedding_store_key(text) % clusters for text in texts),
+                             dtype=np.int64, count=len(texts))
+    # Hash-based vectors give every text its own deterministic noise
+    noise = generate_hash_based_embeddings(texts, dimensions, seed)
+    return normalize_rows(similarity * centroids[assignment] + (1 - similarity) * noise)
 
-def generate_similar_embedding(base_embedding: List[float], similarity: float = 0.95) -> List[float]:
+def generate_similar_embedding(base_embedding: List[float], similarity: float = 0.95,
+                               rng: Optional[np.random.Generator] = None) -> List[float]:
     """Generate an embedding similar to a base embedding"""
     base = np.array(base_embedding)
-    noise = np.random.randn(len(base))
+    noise = (rng or random_rng).standard_normal(len(base))
     noise = noise / np.linalg.norm(noise)
     result = similarity * base + (1 - similarity) * noise
     result = result / np.linalg.norm(result)
@@ -393,15 +2275,718 @@ def load_embeddings_from_file(filepath: str) -> Optional[Dict[str, List[float]]]
         logger.warning(f"Failed to load embeddings from {filepath}: {e}")
         return None
 
-def embeddings_to_base64(embeddings: List[float]) -> str:
-    """Convert embeddings to base64 encoded string"""
-    # Pack floats as little-endian binary data
-    binary_data = struct.pack(f'<{len(embeddings)}f', *embeddings)
-    # Encode to base64
-    return base64.b64encode(binary_data).decode('utf-8')
+def embedding_store_key(text: str) -> int:
+    """64-bit key used to index a text in an embedding store"""
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little")
 
-async def handle_request(endpoint: str, request_data: Dict[str, Any], stream: Optional[bool], raw_request: Optional[str] = None) -> Any:
-    """Handle request with appropriate response mode"""
+def embedding_store_paths(filepath: str) -> tuple:
+    """Return the (vectors, keys, texts) paths of the binary store for a JSON embeddings file"""
+    base = filepath
+    for suffix in (".vectors.npy", ".keys.npy", ".texts.json", ".json"):
+        if base.endswith(suffix):
+            base = base[:-len(suffix)]
+            break
+    return f"{base}.vectors.npy", f"{base}.keys.npy", f"{base}.texts.json"
+
+class NearestTextIndex:
+    """MinHash LSH index over character trigrams, for finding the most similar known text"""
+    
+    NUM_PERM = 32
+    BANDS = 8
+    MAX_CANDIDATES_PER_BAND = 256
+    CHUNK_TEXTS = 65536
+    PRIME = np.uint64(4294967311)  # Smallest prime above 2**32
+    
+    def __init__(self, texts: List[str]):
+        # Fixed seed so signatures are comparable between builds
+        rng = np.random.default_rng(0x5EED)
+        self._a = rng.integers(1, int(self.PRIME), self.NUM_PERM, dtype=np.uint64)
+        self._b = rng.integers(0, int(self.PRIME), self.NUM_PERM, dtype=np.uint64)
+        self._band_multipliers = rng.integers(1, 2**63, self.NUM_PERM // self.BANDS, dtype=np.uint64) | np.uint64(1)
+        
+        chunks = [self.signatures(texts[i:i + self.CHUNK_TEXTS]) for i in range(0, len(texts), self.CHUNK_TEXTS)]
+        self._signatures = np.vstack(chunks) if chunks else np.empty((0, self.NUM_PERM), dtype=np.uint32)
+        
+        # Per band: band hashes sorted for binary search, plus the row each one belongs to
+        self._bands = []
+        for band_keys in self._band_keys(self._signatures):
+            order = np.argsort(band_keys, kind="stable")
+            self._bands.append((band_keys[order], order))
+    
+    def signatures(self, texts: List[str]) -> np.ndarray:
+        """Compute MinHash signatures of the trigram sets of texts"""
+        padded = [f" {text.lower()} " for text in texts]
+        lengths = np.fromiter(map(len, padded), dtype=np.int64, count=len(padded))
+        codes = np.frombuffer("\0".join(padded).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        starts = np.concatenate(([0], np.cumsum(lengths + 1)[:-1]))
+        
+        # Positions of every trigram that lies completely inside its own text
+        counts = np.maximum(lengths - 2, 0)
+        offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        positions = np.arange(counts.sum()) - np.repeat(offsets - starts, counts)
+        grams = (codes[positions] << np.uint64(42)) ^ (codes[positions + 1] << np.uint64(21)) ^ codes[positions + 2]
+        grams = (grams * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(32)
+        
+        signatures = np.full((len(texts), self.NUM_PERM), 0xFFFFFFFF, dtype=np.uint32)
+        nonempty = counts > 0
+        if grams.size:
+            for j in range(self.NUM_PERM):
+                hashed = ((self._a[j] * grams + self._b[j]) % self.PRIME) & np.uint64(0xFFFFFFFF)
+                signatures[nonempty, j] = np.minimum.reduceat(hashed, offsets[nonempty])
+        return signatures
+    
+    def _band_keys(self, signatures: np.ndarray) -> List[np.ndarray]:
+        rows = self.NUM_PERM // self.BANDS
+        return [
+            (signatures[:, band * rows:(band + 1) * rows].astype(np.uint64) * self._band_multipliers).sum(axis=1)
+            for band in range(self.BANDS)
+        ]
+    
+    def nearest(self, texts: List[str]) -> List[Optional[tuple]]:
+        """Return (row, estimated Jaccard similarity) of the most similar indexed text for each text"""
+        signatures = self.signatures(texts)
+        # Candidate ranges of every query in every band, found with one search per band
+        ranges = []
+        for (sorted_keys, order), keys in zip(self._bands, self._band_keys(signatures)):
+            low = np.searchsorted(sorted_keys, keys, side="left")
+            high = np.minimum(np.searchsorted(sorted_keys, keys, side="right"), low + self.MAX_CANDIDATES_PER_BAND)
+            ranges.append((order, low.tolist(), high.tolist()))
+        
+        matches = []
+        for i, signature in enumerate(signatures):
+            candidates = np.unique(np.concatenate([order[low[i]:high[i]] for order, low, high in ranges]))
+            if candidates.size == 0:
+                matches.append(None)
+                continue
+            similarity = (self._signatures[candidates] == signature).mean(axis=1)
+            best = int(np.argmax(similarity))
+            matches.append((int(candidates[best]), float(similarity[best])))
+        return matches
+
+class EmbeddingStore:
+    """Embedding matrix (usually memory-mapped) with a text -> row index"""
+    
+    # Smaller stores build their nearest-text index in the calling worker thread (requests using
+    # a store run off the event loop), larger ones on a background thread
+    SYNC_INDEX_LIMIT = 50000
+    
+    def __init__(self, vectors: np.ndarray, keys: np.ndarray, texts: Optional[List[str]] = None,
+                 texts_path: Optional[str] = None):
+        self.vectors = vectors
+        self.rows = dict(zip(keys.tolist(), range(len(keys))))
+        self._texts = texts
+        self._texts_path = texts_path
+        self._nearest_index = None
+        self._nearest_index_lock = threading.Lock()
+        self._nearest_index_building = False
+    
+    @property
+    def dimensions(self) -> int:
+        return self.vectors.shape[1]
+    
+    def row(self, text: str) -> Optional[int]:
+        """Return the matrix row holding the embedding for text, if any"""
+        return self.rows.get(embedding_store_key(text))
+    
+    def lookup(self, text: str) -> Optional[np.ndarray]:
+        """Return the stored embedding for text as a view into the matrix"""
+        row = self.row(text)
+        return None if row is None else self.vectors[row]
+    
+    def texts(self) -> Optional[List[str]]:
+        """Return the stored texts in row order, loading them on first use"""
+        if self._texts is None and self._texts_path:
+            try:
+                with open(self._texts_path, 'r') as f:
+                    self._texts = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Nearest-text fallback unavailable, failed to load {self._texts_path}: {e}")
+                self._texts_path = None
+        return self._texts
+    
+    def nearest_index(self) -> Optional[NearestTextIndex]:
+        """Return the nearest-text index, or None while it is still being built"""
+        with self._nearest_index_lock:
+            if self._nearest_index is not None or self._nearest_index_building:
+                return self._nearest_index
+            texts = self.texts()
+            if not texts:
+                return None
+            if len(texts) <= self.SYNC_INDEX_LIMIT:
+                self._nearest_index = NearestTextIndex(texts)
+                return self._nearest_index
+            self._nearest_index_building = True
+        
+        logger.info(f"Building nearest-text index over {len(texts)} embedding keys in the background")
+        threading.Thread(target=self._build_nearest_index, args=(texts,),
+                         name="embedding-nn-index", daemon=True).start()
+        return None
+    
+    def _build_nearest_index(self, texts: List[str]):
+        index = NearestTextIndex(texts)
+        with self._nearest_index_lock:
+            self._nearest_index = index
+            self._nearest_index_building = False
+        logger.info(f"Nearest-text index over {len(texts)} embedding keys is ready")
+    
+    @classmethod
+    def from_embeddings(cls, embeddings: Dict[str, List[float]]) -> "EmbeddingStore":
+        """Build an in-memory store from a text -> vector mapping"""
+        vectors = np.asarray(list(embeddings.values()), dtype=np.float64)
+        if vectors.ndim != 2:
+            raise ValueError("All embeddings must be lists of numbers with the same length")
+        keys = np.fromiter((embedding_store_key(text) for text in embeddings), dtype=np.uint64, count=len(embeddings))
+        if len(np.unique(keys)) != len(keys):
+            raise ValueError("Hash collision between two texts; cannot build store")
+        return cls(vectors, keys, texts=list(embeddings))
+    
+    @classmethod
+    def open(cls, vectors_path: str, keys_path: str, texts_path: str) -> "EmbeddingStore":
+        """Open a store written by build_embedding_store without reading the vectors into memory"""
+        return cls(np.load(vectors_path, mmap_mode="r"), np.load(keys_path), texts_path=texts_path)
+
+def build_embedding_store(filepath: str) -> tuple:
+    """Convert a JSON embeddings file into a binary store next to it"""
+    embeddings = load_embeddings_from_file(filepath)
+    if embeddings is None:
+        raise ValueError(f"Could not read embeddings from {filepath}")
+    store = EmbeddingStore.from_embeddings(embeddings)
+    keys = np.fromiter(store.rows, dtype=np.uint64, count=len(store.rows))
+    vectors_path, keys_path, texts_path = embedding_store_paths(filepath)
+    np.save(vectors_path, store.vectors)
+    np.save(keys_path, keys)
+    # Texts are only read when the nearest-text fallback needs them
+    with open(texts_path, 'w') as f:
+        json.dump(store.texts(), f)
+    return vectors_path, keys_path, texts_path, store.vectors.shape
+
+# Opened embedding stores by requested filepath: filepath -> (mtime, store)
+embedding_stores = {}
+embedding_stores_lock = threading.Lock()
+
+def open_embedding_store(filepath: str) -> Optional[EmbeddingStore]:
+    """Open the embeddings for filepath once, reloading them when the files change"""
+    vectors_path, keys_path, texts_path = embedding_store_paths(filepath)
+    try:
+        if os.path.exists(vectors_path) and os.path.exists(keys_path):
+            source = vectors_path
+            mtime = max(os.stat(vectors_path).st_mtime_ns, os.stat(keys_path).st_mtime_ns)
+            if os.path.exists(filepath) and filepath != vectors_path and os.stat(filepath).st_mtime_ns > mtime:
+                logger.warning(f"Embedding store {vectors_path} is older than {filepath}; "
+                               f"rebuild it with --build-embedding-store. Using the JSON file.")
+                source = filepath
+                mtime = os.stat(filepath).st_mtime_ns
+        else:
+            source = filepath
+            mtime = os.stat(filepath).st_mtime_ns
+    except OSError as e:
+        logger.warning(f"Failed to load embeddings from {filepath}: {e}")
+        return None
+    
+    with embedding_stores_lock:
+        cached = embedding_stores.get(filepath)
+        if cached and cached[0] == (source, mtime):
+            return cached[1]
+        
+        try:
+            if source == vectors_path:
+                store = EmbeddingStore.open(vectors_path, keys_path, texts_path)
+            else:
+                embeddings = load_embeddings_from_file(filepath)
+                if embeddings is None:
+                    return None
+                store = EmbeddingStore.from_embeddings(embeddings)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to load embeddings from {filepath}: {e}")
+            return None
+        
+        embedding_stores[filepath] = ((source, mtime), store)
+        return store
+
+def embedding_matrix_to_base64(matrix: np.ndarray, dtype: Any = '<f4') -> List[str]:
+    """Convert every row of an embedding matrix to a base64 encoded string"""
+    if matrix.size == 0:
+        return [""] * matrix.shape[0]
+    # One contiguous copy for the whole batch, rows are sliced from it without copying
+    array = matrix.astype(dtype, order='C')
+    buffer = memoryview(array).cast('B')
+    row_bytes = array.shape[1] * array.itemsize
+    return [
+        base64.b64encode(buffer[start:start + row_bytes]).decode('ascii')
+        for start in range(0, len(buffer), row_bytes)
+    ]
+
+def quantize_int8(matrix: np.ndarray) -> tuple:
+    """Scalar-quantize each row to int8, returning (values, per-row scales)"""
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    values = np.rint(matrix / scales[:, None]).astype(np.int8)
+    return values, scales
+
+def encode_embedding_matrix(matrix: np.ndarray, encoding_format: Optional[str]) -> List[Dict[str, Any]]:
+    """Encode embedding rows into the fields of each response item"""
+    if encoding_format == "base64":
+        return [{"embedding": row} for row in embedding_matrix_to_base64(matrix)]
+    elif encoding_format == "float16":
+        return [{"embedding": row} for row in embedding_matrix_to_base64(matrix, '<f2')]
+    elif encoding_format == "int8":
+        # Dequantize with embedding * scale
+        values, scales = quantize_int8(matrix)
+        return [{"embedding": row, "scale": scale} for row, scale in zip(values.tolist(), scales.tolist())]
+    elif encoding_format == "binary":
+        # One sign bit per dimension, packed most significant bit first
+        packed = np.packbits(matrix > 0, axis=1)
+        return [{"embedding": row} for row in embedding_matrix_to_base64(packed, np.uint8)]
+    else:
+        return [{"embedding": row} for row in matrix.tolist()]
+
+def fill_nearest_embeddings(store: EmbeddingStore, matrix: np.ndarray, inputs: List[str],
+                            missing: List[int], seed: Optional[int] = None) -> List[int]:
+    """Fill rows for unknown texts from their most similar stored text, returning rows still missing"""
+    index = store.nearest_index()
+    if index is None:
+        return missing
+    
+    still_missing = []
+    for i, match in zip(missing, index.nearest([inputs[i] for i in missing])):
+        if match is None or match[1] < EMBEDDING_NN_MIN_SIMILARITY:
+            still_missing.append(i)
+            continue
+        matrix[i] = store.vectors[match[0]]
+        if embedding_nn_similarity < 1.0:
+            # Perturb deterministically so the same unknown text always gets the same vector
+            rng = embedding_rng(inputs[i], store.dimensions, seed)
+            matrix[i] = generate_similar_embedding(matrix[i], embedding_nn_similarity, rng)
+    return still_missing
+
+def build_embedding_matrix(response_choice: Dict[str, Any], inputs: List[str], dimensions: int,
+                           seed: Optional[int] = None, rng: Optional[np.random.Generator] = None,
+                           model: str = "") -> np.ndarray:
+    """Generate embeddings for all inputs as a single (n, dimensions) matrix"""
+    choice_type = response_choice["type"]
+    count = len(inputs)
+    
+    if choice_type == "zero":
+        return generate_zero_embeddings(count, dimensions)
+    elif choice_type == "sequential":
+        return generate_sequential_embeddings(count, dimensions)
+    elif choice_type == "hash":
+        return generate_hash_based_embeddings(inputs, dimensions, seed)
+    elif choice_type == "clustered":
+        clusters, similarity = clustered_settings(response_choice)
+        return generate_clustered_embeddings(inputs, dimensions, model, seed, clusters, similarity)
+    elif choice_type == "file":
+        store = open_embedding_store(response_choice["filepath"])
+        # Vectors from the file keep their own dimensionality
+        width = store.dimensions if store else dimensions
+        rows = [store.row(text) if store else None for text in inputs]
+        found = [i for i, row in enumerate(rows) if row is not None]
+        missing = [i for i, row in enumerate(rows) if row is None]
+        matrix = np.empty((count, width))
+        if found:
+            matrix[found] = store.vectors[[rows[i] for i in found]]
+        if missing and store and embedding_nn_fallback:
+            missing = fill_nearest_embeddings(store, matrix, inputs, missing, seed)
+        if missing:
+            # Fallback to hash-based if not found in file
+            matrix[missing] = generate_hash_based_embeddings([inputs[i] for i in missing], width, seed)
+        return matrix
+    elif choice_type == "custom":
+        custom = np.asarray(response_choice["data"], dtype=float)
+        if custom.ndim == 2 and custom.shape[0] == count:
+            # One custom vector per input
+            return custom
+        if custom.ndim != 1:
+            raise ValueError("Custom embedding must be a JSON array of numbers (or one array per input)")
+        return np.broadcast_to(custom, (count, custom.shape[0]))
+    else:
+        return generate_random_embeddings(count, dimensions, seed, rng)
+
+@functools.lru_cache(maxsize=32)
+def embedding_row_format(dimensions: int) -> str:
+    """printf-style format for one embedding as a JSON array with fixed precision"""
+    return "[" + ",".join([f"%.{EMBEDDING_FLOAT_PRECISION}g"] * dimensions) + "]"
+
+async def stream_embeddings(response_choice: Dict[str, Any], inputs: List[str], dimensions: int,
+                            seed: Optional[int], encoding_format: Optional[str], model: str, total_tokens: int):
+    """Write an embeddings response as JSON text, a few vectors at a time"""
+    # Keep one generator for the whole response so seeded batches don't repeat per block
+    rng = np.random.default_rng(seed % 2**64) if seed is not None else None
+    block_rows = max(1, EMBEDDING_STREAM_BLOCK_VALUES // max(dimensions, 1))
+    
+    yield '{"object": "list", "data": ['
+    for start in range(0, len(inputs), block_rows):
+        block_inputs = inputs[start:start + block_rows]
+        if response_choice["type"] == "file":
+            # Store lookups and the nearest-text index build run off the event loop
+            matrix = await asyncio.to_thread(build_embedding_matrix, response_choice, block_inputs, dimensions,
+                                             seed, rng, model)
+        else:
+            matrix = build_embedding_matrix(response_choice, block_inputs, dimensions, seed, rng, model)
+        
+        if encoding_format in EMBEDDING_ENCODING_FORMATS:
+            # Compact formats are small enough for the regular JSON encoder
+            fields = [json.dumps(item, separators=(",", ":"))[1:-1]
+                      for item in encode_embedding_matrix(matrix, encoding_format)]
+        else:
+            row_format = embedding_row_format(matrix.shape[1])
+            fields = ['"embedding": ' + row_format % tuple(row) for row in matrix.tolist()]
+        
+        yield "".join(
+            f'{", " if index else ""}{{"object": "embedding", {field}, "index": {index}}}'
+            for index, field in enumerate(fields, start)
+        )
+        # Give other requests a chance to run between blocks
+        await asyncio.sleep(0)
+    
+    yield (f'], "model": {json.dumps(model)}, '
+           f'"usage": {{"prompt_tokens": {total_tokens}, "total_tokens": {total_tokens}}}}}')
+
+# Request fields that don't change the recorded answer
+CASSETTE_IGNORED_FIELDS = ("stream", "stream_options", "user", "metadata", "encoding_format")
+
+def canonical_request(value: Any) -> Any:
+    """Drop unset (None) fields recursively so omitted and null parameters hash the same"""
+    if isinstance(value, dict):
+        return {key: canonical_request(item) for key, item in value.items() if item is not None}
+    if isinstance(value, (list, tuple)):
+        return [canonical_request(item) for item in value]
+    return value
+
+def cassette_key(endpoint: str, request_data: Dict[str, Any]) -> str:
+    """Canonical hash of endpoint, model, messages, tools and parameters"""
+    fields = canonical_request({key: value for key, value in request_data.items()
+                                if key not in CASSETTE_IGNORED_FIELDS})
+    canonical = json.dumps([endpoint, fields], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class Cassette:
+    """Recorded responses in a JSON lines file, indexed by canonical request hash"""
+    
+    # Every line starts with {"key": "<sha256>", so the index is built without parsing JSON;
+    # entries are only read and parsed when a request matches them
+    KEY_PREFIX = b'{"key": "'
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        self._offsets = None
+        self._lock = threading.Lock()
+    
+    def index(self) -> Dict[str, int]:
+        """Offsets of the latest entry per key, loaded on first use"""
+        with self._lock:
+            if self._offsets is None:
+                offsets = {}
+                start = len(self.KEY_PREFIX)
+                try:
+                    with open(self.path, 'rb') as f:
+                        position = 0
+                        for line in f:
+                            if line.startswith(self.KEY_PREFIX):
+                                offsets[line[start:start + 64].decode('ascii')] = position
+                            position += len(line)
+                except FileNotFoundError:
+                    pass
+                self._offsets = offsets
+            return self._offsets
+    
+    def _read(self, offset: int) -> Dict[str, Any]:
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+    
+    async def lookup(self, endpoint: str, request_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Recorded entry for a request; file access (and the first index build) runs off the event loop"""
+        offsets = self._offsets
+        if offsets is None:
+            # Waits for the index on a worker thread, not on the event loop
+            offsets = await asyncio.to_thread(self.index)
+        offset = offsets.get(cassette_key(endpoint, request_data))
+        if offset is None:
+            self.misses += 1
+            return None
+        entry = await asyncio.to_thread(self._read, offset)
+        self.hits += 1
+        return entry
+    
+    async def record(self, endpoint: str, request_data: Dict[str, Any], outcome: Dict[str, Any]):
+        await asyncio.to_thread(self.append, endpoint, request_data, outcome)
+    
+    def append(self, endpoint: str, request_data: Dict[str, Any], outcome: Dict[str, Any]):
+        """Append an answer: {"response": text}, {"embedding_type": choice} or {"error": {...}}"""
+        key = cassette_key(endpoint, request_data)
+        line = json.dumps({
+            "key": key,
+            "endpoint": endpoint,
+            **outcome,
+            # Kept for people editing cassettes; matching only uses the key
+            "request": canonical_request({k: v for k, v in request_data.items() if k not in CASSETTE_IGNORED_FIELDS})
+        }).encode('utf-8') + b"\n"
+        with self._lock:
+            with open(self.path, 'ab') as f:
+                offset = f.tell()
+                f.write(line)
+            if self._offsets is not None:
+                self._offsets[key] = offset
+            self.recorded += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "entries": len(self._offsets) if self._offsets is not None else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "recorded": self.recorded
+        }
+
+# Replay answers from a cassette (--cassette) and/or record responder answers (--record-cassette)
+replay_cassette: Optional[Cassette] = None
+record_cassette: Optional[Cassette] = None
+# What to do when a request is not in the replay cassette: "responder", "error" or "default"
+replay_miss = "responder"
+
+def resolve_blob_references(value: Any) -> Any:
+    """Replace blob store references with their content"""
+    if isinstance(value, dict):
+        if isinstance(value.get("$blob"), str):
+            with open(blob_store.path(value["$blob"]), 'r', encoding='utf-8') as f:
+                return f.read()
+        return {key: resolve_blob_references(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve_blob_references(item) for item in value]
+    return value
+
+def build_cassette_from_log(cassette: Cassette, log_path: str = 'request_log.json') -> tuple:
+    """Record every successfully answered request in the request log into a cassette;
+    returns how many were recorded and how many were skipped because they can't be replayed"""
+    requests_by_id = {}
+    recorded = 0
+    skipped = 0
+    for line in iter_log_lines(log_path):
+        record = json.loads(line)
+        if not record.get("event"):
+            if record.get("id"):
+                requests_by_id[record["id"]] = (record.get("endpoint", ""), record.get("request") or {})
+            continue
+        if record["event"] != "response" or record.get("status") != 200:
+            continue
+        logged = requests_by_id.pop(record.get("id"), None)
+        if logged is None or record.get("response") is None:
+            continue
+        endpoint, request_data = logged
+        try:
+            if blob_store is not None:
+                request_data = resolve_blob_references(request_data)
+                response_body = resolve_blob_references(record["response"])
+            else:
+                response_body = record["response"]
+        except OSError:
+            skipped += 1
+            continue
+        request_json = json.dumps(request_data)
+        if not isinstance(response_body, str) or "$blob" in request_json or "... (truncated)" in request_json:
+            # Blob references can't be resolved without the blob store, and base64 payloads cut
+            # in the log would never hash like the live request
+            skipped += 1
+            continue
+        if endpoint == "/v1/embeddings":
+            outcome = json.loads(response_body)
+        else:
+            outcome = {"response": response_body}
+        cassette.append(endpoint, request_data, outcome)
+        recorded += 1
+    return recorded, skipped
+
+def cassette_error(entry: Dict[str, Any]) -> HTTPException:
+    error = entry["error"]
+    return HTTPException(status_code=error.get("status_code", 500), detail=error.get("message", "Unknown error"))
+
+def system_prompt(request_data: Dict[str, Any]) -> str:
+    """Text of the Anthropic system prompt, or of OpenAI system / developer messages"""
+    system = request_data.get("system")
+    if system is None and isinstance(request_data.get("messages"), list):
+        system = [message.get("content") for message in request_data["messages"]
+                  if isinstance(message, dict) and message.get("role") in ("system", "developer")]
+    if isinstance(system, list):
+        texts = []
+        for item in system:
+            if isinstance(item, str):
+                texts.append(item)
+            elif isinstance(item, dict) and item.get("type") == "text":
+                texts.append(item.get("text", ""))
+            elif isinstance(item, list):
+                texts.append(system_prompt({"system": item}))
+        system = "\n".join(texts)
+    return system if isinstance(system, str) else ""
+
+class ResponseRules:
+    """Auto-response rules from a JSON file, compiled into an index and reloaded when the file changes"""
+    
+    # Regex fields, matched against the last user message and the system prompt
+    TEXT_FIELDS = ("message", "system")
+    # Settings a rule can apply to the requests it matches, with or without answering them
+    OPTION_FIELDS = ("latency_profile", "chunking")
+    CHECK_INTERVAL = 1.0
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.rules = []
+        self.models = set()  # Models named by rules, labelled individually in /metrics
+        self.matched = 0
+        self.reloads = 0
+        self.error = None
+        self._buckets = {}
+        self._mtime = None
+        self._checked = 0.0
+        self.load()
+    
+    @staticmethod
+    def _values(rule: Dict[str, Any], field: str) -> List[Any]:
+        value = rule.get(field)
+        if value is None:
+            return [None]
+        return list(value) if isinstance(value, list) else [value]
+    
+    def _compile(self, rules: List[Dict[str, Any]]) -> Dict[tuple, List[int]]:
+        for index, rule in enumerate(rules):
+            if not isinstance(rule, dict):
+                raise ValueError(f"rule {index} is not an object")
+            if not any(field in rule for field in ("response", "error") + self.OPTION_FIELDS):
+                raise ValueError(f"rule {index} needs a 'response', an 'error' or an option like 'latency_profile'")
+            for field in self.TEXT_FIELDS:
+                if rule.get(field) is not None:
+                    try:
+                        rule[f"_{field}"] = re.compile(rule[field])
+                    except re.error as e:
+                        raise ValueError(f"rule {index}: invalid {field} pattern: {e}")
+            # Keys are compared by fingerprint, like the request store
+            rule["_api_keys"] = {hashlib.sha256(str(key).encode()).hexdigest()[:16]
+                                 for key in self._values(rule, "api_key") if key is not None}
+        
+        # Rules are bucketed by (endpoint, model); None stands for "any". Within a bucket rules
+        # keep their file order, and patterns are compiled once here rather than per request.
+        buckets = {}
+        for index, rule in enumerate(rules):
+            for endpoint in self._values(rule, "endpoint"):
+                for model in self._values(rule, "model"):
+                    buckets.setdefault((endpoint, model), []).append(index)
+        return buckets
+    
+    def load(self):
+        """Load and compile the rules file, keeping the previous rules if it is invalid"""
+        mtime = None
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            rules = data.get("rules", []) if isinstance(data, dict) else data
+            if not isinstance(rules, list):
+                raise ValueError("expected a list of rules")
+            buckets = self._compile(rules)
+        except (OSError, ValueError) as e:
+            self.error = str(e)
+            # Remember the broken version so it is only read again once the file changes
+            self._mtime = mtime
+            logger.error(f"Failed to load rules from {self.path}: {e}")
+            return
+        self.rules, self._buckets, self._mtime = rules, buckets, mtime
+        self.models = {model for _, model in buckets if isinstance(model, str)}
+        self.error = None
+        self.reloads += 1
+    
+    def _reload_if_changed(self):
+        now = time.monotonic()
+        if now - self._checked < self.CHECK_INTERVAL:
+            return
+        self._checked = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.load()
+    
+    def match(self, endpoint: str, request_data: Dict[str, Any],
+              http_request: Optional[Request] = None) -> Optional[Dict[str, Any]]:
+        """First rule in file order that matches the request"""
+        self._reload_if_changed()
+        rules, buckets = self.rules, self._buckets
+        # "/v1/messages (Anthropic)" -> "/v1/messages"
+        path = endpoint.split(" ", 1)[0]
+        model = request_data.get("model")
+        texts = {}
+        fingerprint = api_key_fingerprint(http_request)
+        has_tools = bool(request_data.get("tools") or request_data.get("functions"))
+        
+        best = None
+        for key in ((path, model), (path, None), (None, model), (None, None)):
+            for index in buckets.get(key, ()):
+                if best is not None and index >= best:
+                    break
+                rule = rules[index]
+                # Cheap checks first; each text is only extracted when a pattern needs it
+                if rule["_api_keys"] and fingerprint not in rule["_api_keys"]:
+                    continue
+                if "tools" in rule and bool(rule["tools"]) != has_tools:
+                    continue
+                if all(rule.get(f"_{field}") is None or rule[f"_{field}"].search(self._text(field, request_data, texts))
+                       for field in self.TEXT_FIELDS):
+                    best = index
+                    break
+        if best is None:
+            return None
+        self.matched += 1
+        return rules[best]
+    
+    def _text(self, field: str, request_data: Dict[str, Any], texts: Dict[str, str]) -> str:
+        """Text a pattern is matched against, extracted once per request"""
+        if field not in texts:
+            if field == "message":
+                texts[field] = last_user_message(request_data, max_length=None) or ""
+            else:
+                texts[field] = system_prompt(request_data)
+        return texts[field]
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "rules": len(self.rules),
+            "buckets": len(self._buckets),
+            "matched": self.matched,
+            "reloads": self.reloads,
+            "error": self.error
+        }
+
+# Auto-response rules (enabled with --rules), consulted before the cassette and the responder
+response_rules: Optional[ResponseRules] = None
+
+def rule_response(rule: Dict[str, Any], endpoint: str, request_data: Dict[str, Any]) -> str:
+    """Response text of a matched rule; error rules raise an HTTPException"""
+    if "error" in rule:
+        error = rule["error"] if isinstance(rule["error"], dict) else {"message": str(rule["error"])}
+        raise HTTPException(status_code=error.get("status_code", 500), detail=error.get("message", "Unknown error"))
+    response = rule["response"]
+    if isinstance(response, list):
+        response = random.choice(response) if response else ""
+    values = {
+        "endpoint": endpoint,
+        "model": str(request_data.get("model", "")),
+        "message": last_user_message(request_data, max_length=None) or "",
+        "system": system_prompt(request_data)
+    }
+    # Named groups of the rule's patterns can be used in the template too
+    for field in ResponseRules.TEXT_FIELDS:
+        pattern = rule.get(f"_{field}")
+        match = pattern.search(values[field]) if pattern is not None else None
+        if match:
+            values.update({name: value for name, value in match.groupdict().items() if value is not None})
+    return string.Template(str(response)).safe_substitute(values)
+
+def format_prompt_info(endpoint: str, request_data: Dict[str, Any], stream: Optional[bool]) -> str:
+    """Format a request for display in the terminal"""
     # Create prompt info for display
     prompt_info = f"Endpoint: {endpoint}\n"
     prompt_info += f"Model: {request_data.get('model', 'unknown')}\n"
@@ -437,7 +3022,7 @@ async def handle_request(endpoint: str, request_data: Dict[str, Any], stream: Op
                                 truncated_base64 = base64_data[:30]
                                 formatted_content.append(f"[IMAGE: {source.get('media_type', 'unknown')} - base64 data: {truncated_base64}... (truncated)]")
                             else:
-                                formatted_content.append(f"[IMAGE: {item}]")
+                                formatted_content.append(f"[IMAGE: {redacted_json(item)}]")
                         elif item.get('type') == 'image_url':
                             # Handle OpenAI format
                             image_url = item.get('image_url', {})
@@ -454,7 +3039,8 @@ async def handle_request(endpoint: str, request_data: Dict[str, Any], stream: Op
                             else:
                                 formatted_content.append(f"[IMAGE URL: {image_url}]")
                         else:
-                            formatted_content.append(str(item))
+                            # Tool results, documents, etc. - shown as JSON with base64 payloads truncated
+                            formatted_content.append(redacted_json(item))
                     else:
                         formatted_content.append(str(item))
                 content = '\n'.join(formatted_content)
@@ -462,9 +3048,51 @@ async def handle_request(endpoint: str, request_data: Dict[str, Any], stream: Op
     elif "prompt" in request_data:
         prompt_info += f"\nPrompt: {request_data['prompt']}\n"
     
+    return prompt_info
+
+async def handle_request(endpoint: str, request_data: Dict[str, Any], stream: Optional[bool], raw_request: Optional[str] = None,
+                         http_request: Optional[Request] = None) -> Any:
+    """Handle request with appropriate response mode"""
+    if response_rules is not None:
+        rule = response_rules.match(endpoint, request_data, http_request)
+        if rule is not None and http_request is not None:
+            http_request.state.rule = rule
+        if rule is not None and ("response" in rule or "error" in rule):
+            return rule_response(rule, endpoint, request_data)
+    
+    if replay_cassette is not None:
+        entry = await replay_cassette.lookup(endpoint, request_data)
+        if entry is not None:
+            if "error" in entry:
+                raise cassette_error(entry)
+            return entry.get("response", "")
+        if replay_miss == "error":
+            raise HTTPException(status_code=404, detail="No recorded response for this request in the cassette")
+        if replay_miss == "default":
+            return DEFAULT_RESPONSE
+    
+    started = time.perf_counter()
+    try:
+        user_response = await get_responder_answer(endpoint, request_data, stream, raw_request)
+    except HTTPException as e:
+        if record_cassette is not None:
+            await record_cassette.record(endpoint, request_data, {"error": {"status_code": e.status_code, "message": e.detail}})
+        raise
+    finally:
+        metrics.observe("dummy_ai_responder_wait_seconds", (("endpoint", endpoint),), time.perf_counter() - started)
+    
+    if record_cassette is not None:
+        await record_cassette.record(endpoint, request_data, {"response": user_response})
+    return user_response
+
+async def get_responder_answer(endpoint: str, request_data: Dict[str, Any], stream: Optional[bool],
+                               raw_request: Optional[str] = None) -> str:
+    """Ask the CLI or web UI responder for the response text"""
     # Get response based on mode
-    if response_mode == "cli":
-        user_response = get_cli_response(prompt_info)
+    if response_mode == "synthetic":
+        user_response = synthetic_responder.answer(request_data)
+    elif response_mode == "cli":
+        user_response = await get_cli_response(format_prompt_info(endpoint, request_data, stream))
     else:
         request_id = str(uuid.uuid4())
         web_response = await get_web_response(request_id, {
@@ -481,6 +3109,57 @@ async def handle_request(endpoint: str, request_data: Dict[str, Any], stream: Op
     
     return user_response
 
+def timed_json_response(endpoint: str, content: Dict[str, Any]) -> JSONResponse:
+    """Encode a non-streamed response body, recording how long it took"""
+    started = time.perf_counter()
+    response = JSONResponse(content=content)
+    metrics.observe("dummy_ai_serialization_seconds", (("endpoint", endpoint),), time.perf_counter() - started,
+                    Metrics.SERIALIZATION_BUCKETS)
+    return response
+
+@app.middleware("http")
+async def record_request_outcome(request: Request, call_next):
+    """Record API request metrics, and log the outcome of logged requests, once the body has been sent"""
+    if not request.url.path.startswith("/v1/"):
+        return await call_next(request)
+    
+    started = time.perf_counter()
+    metrics.in_flight += 1
+    try:
+        response = await call_next(request)
+    except BaseException:
+        metrics.in_flight -= 1
+        raise
+    record_id = getattr(request.state, "request_record_id", None)
+    body_iterator = response.body_iterator
+    
+    async def body_then_record():
+        # Error bodies are small and worth keeping; successful ones are recorded by the endpoint
+        error_chunks = []
+        sent_bytes = 0
+        try:
+            async for chunk in body_iterator:
+                sent_bytes += len(chunk)
+                if record_id is not None and response.status_code >= 400:
+                    error_chunks.append(chunk)
+                yield chunk
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.in_flight -= 1
+            usage = getattr(request.state, "usage", None)
+            metrics.record_request(getattr(request.state, "endpoint", request.url.path),
+                                   getattr(request.state, "model", ""), response.status_code, elapsed,
+                                   sent_bytes, usage)
+            if record_id is not None:
+                response_body = getattr(request.state, "response_body", None)
+                if response_body is None and error_chunks:
+                    response_body = b"".join(error_chunks).decode("utf-8", "replace")
+                log_response(record_id, response.status_code, round(elapsed * 1000, 3), usage, response_body,
+                             getattr(request.state, "deferred_log", None))
+    
+    response.body_iterator = body_then_record()
+    return response
+
 @app.post("/v1/chat/completions")
 async def chat_completions(request: ChatCompletionRequest, raw_request: Request, _: Any = Depends(verify_api_key)):
     """Handle chat completion requests"""
@@ -501,11 +3180,12 @@ async def chat_completions(request: ChatCompletionRequest, raw_request: Request,
             print(raw_http_request)
             print("="*80 + "\n")
     
-    log_request("/v1/chat/completions", request_dict)
+    await log_request("/v1/chat/completions", request_dict, raw_request)
     
     try:
         stream_param = request.stream if request.stream is not None else False
-        user_response = await handle_request("/v1/chat/completions", request_dict, stream_param, raw_http_request if advanced_mode else None)
+        user_response = await handle_request("/v1/chat/completions", request_dict, stream_param, raw_http_request if advanced_mode else None,
+                                             raw_request)
     except HTTPException as e:
         return Response(
             content=json.dumps({"error": {"message": e.detail, "type": "server_error"}}),
@@ -519,6 +3199,8 @@ async def chat_completions(request: ChatCompletionRequest, raw_request: Request,
             media_type="application/json"
         )
     
+    raw_request.state.response_body = user_response
+    
     # Calculate token usage
     prompt_tokens = 0
     for msg in request.messages:
@@ -536,9 +3218,13 @@ async def chat_completions(request: ChatCompletionRequest, raw_request: Request,
                 else:
                     prompt_tokens += count_tokens(str(item))
     completion_tokens = count_tokens(user_response)
+    raw_request.state.usage = {"prompt_tokens": int(prompt_tokens), "completion_tokens": int(completion_tokens)}
     
     if stream_param:
         # Streaming response
+        pacer = StreamPacer(select_latency_profile(raw_request, request_dict), user_response)
+        chunks = stream_chunks(raw_request, user_response)
+        
         async def generate_stream():
             # Send initial chunk
             chunk = {
@@ -553,14 +3239,10 @@ async def chat_completions(request: ChatCompletionRequest, raw_request: Request,
                 }]
             }
             yield f"data: {json.dumps(chunk)}\n\n"
+            await pacer.wait()  # Time to first token
             
             # Send content in chunks
-            words = user_response.split()
-            for i in range(0, len(words), 3):  # Send 3 words at a time
-                chunk_content = ' '.join(words[i:i+3])
-                if i + 3 < len(words):
-                    chunk_content += ' '
-                
+            for chunk_content in chunks:
                 chunk = {
                     "id": f"chatcmpl-{uuid.uuid4().hex[:8]}",
                     "object": "chat.completion.chunk",
@@ -573,7 +3255,7 @@ async def chat_completions(request: ChatCompletionRequest, raw_request: Request,
                     }]
                 }
                 yield f"data: {json.dumps(chunk)}\n\n"
-                await asyncio.sleep(0.1)  # Simulate streaming delay
+                await pacer.wait(chunk_content)
             
             # Send final chunk
             final_chunk = {
@@ -612,7 +3294,7 @@ async def chat_completions(request: ChatCompletionRequest, raw_request: Request,
                 "total_tokens": int(prompt_tokens + completion_tokens)
             }
         }
-        return response
+        return timed_json_response("/v1/chat/completions", response)
 
 @app.post("/v1/completions")
 async def completions(request: CompletionRequest, raw_request: Request, _: Any = Depends(verify_api_key)):
@@ -634,11 +3316,12 @@ async def completions(request: CompletionRequest, raw_request: Request, _: Any =
             print(raw_http_request)
             print("="*80 + "\n")
     
-    log_request("/v1/completions", request_dict)
+    await log_request("/v1/completions", request_dict, raw_request)
     
     try:
         stream_param = request.stream if request.stream is not None else False
-        user_response = await handle_request("/v1/completions", request_dict, stream_param, raw_http_request if advanced_mode else None)
+        user_response = await handle_request("/v1/completions", request_dict, stream_param, raw_http_request if advanced_mode else None,
+                                             raw_request)
     except HTTPException as e:
         return Response(
             content=json.dumps({"error": {"message": e.detail, "type": "server_error"}}),
@@ -652,21 +3335,22 @@ async def completions(request: CompletionRequest, raw_request: Request, _: Any =
             media_type="application/json"
         )
     
+    raw_request.state.response_body = user_response
+    
     # Calculate token usage
     prompt_text = request.prompt if isinstance(request.prompt, str) else str(request.prompt)
     prompt_tokens = count_tokens(prompt_text)
     completion_tokens = count_tokens(user_response)
+    raw_request.state.usage = {"prompt_tokens": int(prompt_tokens), "completion_tokens": int(completion_tokens)}
     
     if stream_param:
         # Streaming response
+        pacer = StreamPacer(select_latency_profile(raw_request, request_dict), user_response)
+        chunks = stream_chunks(raw_request, user_response)
+        
         async def generate_stream():
-            words = user_response.split()
-            
-            for i in range(0, len(words), 3):  # Send 3 words at a time
-                chunk_content = ' '.join(words[i:i+3])
-                if i + 3 < len(words):
-                    chunk_content += ' '
-                
+            await pacer.wait()  # Time to first token
+            for chunk_content in chunks:
                 chunk = {
                     "id": f"cmpl-{uuid.uuid4().hex[:8]}",
                     "object": "text_completion",
@@ -680,7 +3364,7 @@ async def completions(request: CompletionRequest, raw_request: Request, _: Any =
                     }]
                 }
                 yield f"data: {json.dumps(chunk)}\n\n"
-                await asyncio.sleep(0.1)  # Simulate streaming delay
+                await pacer.wait(chunk_content)
             
             # Send final chunk
             final_chunk = {
@@ -718,7 +3402,7 @@ async def completions(request: CompletionRequest, raw_request: Request, _: Any =
                 "total_tokens": int(prompt_tokens + completion_tokens)
             }
         }
-        return response
+        return timed_json_response("/v1/completions", response)
 
 @app.post("/v1/embeddings")
 async def create_embeddings(request: EmbeddingRequest, raw_request: Request, _: Any = Depends(verify_api_key)):
@@ -739,7 +3423,8 @@ async def create_embeddings(request: EmbeddingRequest, raw_request: Request, _:
             print(raw_http_request)
             print("="*80 + "\n")
     
-    log_request("/v1/embeddings", request.model_dump())
+    request_dict = request.model_dump()
+    await log_request("/v1/embeddings", request_dict, raw_request)
     
     # Determine dimensions
     dimensions = request.dimensions
@@ -749,15 +3434,58 @@ async def create_embeddings(request: EmbeddingRequest, raw_request: Request, _:
     # Ensure input is a list
     inputs = request.input if isinstance(request.input, list) else [request.input]
     
+    response_choice = None
+    if replay_cassette is not None:
+        entry = await replay_cassette.lookup("/v1/embeddings", request_dict)
+        if entry is not None and "error" in entry:
+            error = cassette_error(entry)
+            return Response(
+                content=json.dumps({
+                    "error": {
+                        "message": error.detail,
+                        "type": "mock_error",
+                        "code": "mock_error"
+                    }
+                }),
+                status_code=error.status_code,
+                media_type="application/json"
+            )
+        if entry is not None:
+            response_choice = entry.get("embedding_type", {"type": "random"})
+        elif replay_miss == "error":
+            return Response(
+                content=json.dumps({
+                    "error": {
+                        "message": "No recorded response for this request in the cassette",
+                        "type": "mock_error",
+                        "code": "mock_error"
+                    }
+                }),
+                status_code=404,
+                media_type="application/json"
+            )
+        elif replay_miss == "default":
+            response_choice = {"type": "random"}
+    
     # Get embedding response based on mode
-    if response_mode == "cli":
+    responder_started = time.perf_counter()
+    if response_choice is not None:
+        # Answered from the cassette
+        pass
+    elif response_mode == "synthetic":
+        response_choice = {"type": "random"}
+    elif response_mode == "cli":
         prompt_info = f"Endpoint: /v1/embeddings\n"
         prompt_info += f"Model: {request.model}\n"
         prompt_info += f"Dimensions: {dimensions}\n"
         prompt_info += f"Input count: {len(inputs)}\n"
         prompt_info += f"First input: {inputs[0][:100]}..." if inputs[0] and len(inputs[0]) > 100 else f"First input: {inputs[0]}\n"
         
-        response_choice = get_cli_embedding_response(prompt_info, dimensions)
+        response_choice = await get_cli_embedding_response(prompt_info, dimensions)
+        metrics.observe("dummy_ai_responder_wait_seconds", (("endpoint", "/v1/embeddings"),),
+                        time.perf_counter() - responder_started)
+        if record_cassette is not None:
+            await record_cassette.record("/v1/embeddings", request_dict, {"embedding_type": response_choice})
     else:
         # Web mode
         request_id = str(uuid.uuid4())
@@ -770,10 +3498,15 @@ async def create_embeddings(request: EmbeddingRequest, raw_request: Request, _:
                 "encoding_format": request.encoding_format
             }
         }, raw_http_request)
+        metrics.observe("dummy_ai_responder_wait_seconds", (("endpoint", "/v1/embeddings"),),
+                        time.perf_counter() - responder_started)
         
         if response_data["type"] == "error":
             error_message = response_data.get("message", response_data.get("response", "Unknown error"))
             status_code = response_data.get("status_code", 400)
+            if record_cassette is not None:
+                await record_cassette.record("/v1/embeddings", request_dict,
+                                       {"error": {"status_code": status_code, "message": error_message}})
             return Response(
                 content=json.dumps({
                     "error": {
@@ -787,45 +3520,71 @@ async def create_embeddings(request: EmbeddingRequest, raw_request: Request, _:
             )
         
         response_choice = response_data.get("embedding_type", {"type": "random"})
+        if record_cassette is not None:
+            await record_cassette.record("/v1/embeddings", request_dict, {"embedding_type": response_choice})
+    
+    if response_choice["type"] == "clustered":
+        try:
+            clustered_settings(response_choice)
+        except (TypeError, ValueError) as e:
+            return Response(
+                content=json.dumps({
+                    "error": {
+                        "message": f"Invalid embedding response: {e}",
+                        "type": "mock_error",
+                        "code": "mock_error"
+                    }
+                }),
+                status_code=400,
+                media_type="application/json"
+            )
     
-    # Generate embeddings based on choice
-    embeddings = []
-    total_tokens = 0
+    raw_request.state.response_body = json.dumps({"embedding_type": response_choice})
+    total_tokens = sum(count_tokens(input_text) for input_text in inputs)
     
-    for input_text in inputs:
-        total_tokens += count_tokens(input_text)
-        
-        if response_choice["type"] == "random":
-            embedding = generate_random_embedding(dimensions)
-        elif response_choice["type"] == "zero":
-            embedding = generate_zero_embedding(dimensions)
-        elif response_choice["type"] == "sequential":
-            embedding = generate_sequential_embedding(dimensions)
-        elif response_choice["type"] == "hash":
-            embedding = generate_hash_based_embedding(input_text, dimensions)
-        elif response_choice["type"] == "file":
-            loaded_embeddings = load_embeddings_from_file(response_choice["filepath"])
-            if loaded_embeddings and input_text in loaded_embeddings:
-                embedding = loaded_embeddings[input_text]
-            else:
-                # Fallback to hash-based if not found in file
-                embedding = generate_hash_based_embedding(input_text, dimensions)
-        elif response_choice["type"] == "custom":
-            embedding = response_choice["data"]
-        else:
-            embedding = generate_random_embedding(dimensions)
-        
-        # Format embedding based on encoding_format
-        if request.encoding_format == "base64":
-            embedding_data = embeddings_to_base64(embedding)
+    # Large generated batches are written out incrementally instead of being built in memory
+    if (embedding_stream_threshold > 0 and response_choice["type"] != "custom"
+            and len(inputs) * dimensions >= embedding_stream_threshold):
+        raw_request.state.usage = {"prompt_tokens": int(total_tokens), "completion_tokens": 0}
+        return StreamingResponse(
+            stream_embeddings(response_choice, inputs, dimensions, request.seed,
+                              request.encoding_format, request.model, total_tokens),
+            media_type="application/json"
+        )
+    
+    # Generate all embeddings as one matrix
+    try:
+        if response_choice["type"] == "file":
+            # Store lookups and the nearest-text index build run off the event loop
+            embedding_matrix = await asyncio.to_thread(build_embedding_matrix, response_choice, inputs, dimensions,
+                                                       request.seed, model=request.model)
         else:
-            embedding_data = embedding
-            
-        embeddings.append({
+            embedding_matrix = build_embedding_matrix(response_choice, inputs, dimensions, request.seed,
+                                                      model=request.model)
+    except (ValueError, TypeError) as e:
+        return Response(
+            content=json.dumps({
+                "error": {
+                    "message": f"Invalid embedding response: {e}",
+                    "type": "mock_error",
+                    "code": "mock_error"
+                }
+            }),
+            status_code=400,
+            media_type="application/json"
+        )
+    raw_request.state.usage = {"prompt_tokens": int(total_tokens), "completion_tokens": 0}
+    
+    # Format embeddings based on encoding_format
+    serialization_started = time.perf_counter()
+    embeddings = [
+        {
             "object": "embedding",
-            "embedding": embedding_data,
-            "index": len(embeddings)
-        })
+            **item,
+            "index": index
+        }
+        for index, item in enumerate(encode_embedding_matrix(embedding_matrix, request.encoding_format))
+    ]
     
     # Return response
     response = {
@@ -838,51 +3597,58 @@ async def create_embeddings(request: EmbeddingRequest, raw_request: Request, _:
         }
     }
     
-    return response
+    # Encode directly; the response only holds plain lists, strings and numbers
+    json_response = JSONResponse(content=response)
+    metrics.observe("dummy_ai_serialization_seconds", (("endpoint", "/v1/embeddings"),),
+                    time.perf_counter() - serialization_started, Metrics.SERIALIZATION_BUCKETS)
+    return json_response
+
+# Served by /v1/models; /metrics also labels these models individually
+AVAILABLE_MODELS = [
+    {
+        "id": "gpt-4",
+        "object": "model",
+        "created": 1687882411,
+        "owned_by": "openai"
+    },
+    {
+        "id": "gpt-3.5-turbo",
+        "object": "model",
+        "created": 1677610602,
+        "owned_by": "openai"
+    },
+    {
+        "id": "text-davinci-003",
+        "object": "model",
+        "created": 1669599635,
+        "owned_by": "openai-internal"
+    },
+    {
+        "id": "text-embedding-ada-002",
+        "object": "model",
+        "created": 1671217299,
+        "owned_by": "openai-internal"
+    },
+    {
+        "id": "text-embedding-3-small",
+        "object": "model",
+        "created": 1705948997,
+        "owned_by": "system"
+    },
+    {
+        "id": "text-embedding-3-large",
+        "object": "model",
+        "created": 1705953180,
+        "owned_by": "system"
+    }
+]
 
 @app.get("/v1/models")
 async def list_models(_: Any = Depends(verify_api_key)):
     """List available models (mimicking OpenAI's response)"""
     return {
         "object": "list",
-        "data": [
-            {
-                "id": "gpt-4",
-                "object": "model",
-                "created": 1687882411,
-                "owned_by": "openai"
-            },
-            {
-                "id": "gpt-3.5-turbo",
-                "object": "model",
-                "created": 1677610602,
-                "owned_by": "openai"
-            },
-            {
-                "id": "text-davinci-003",
-                "object": "model",
-                "created": 1669599635,
-                "owned_by": "openai-internal"
-            },
-            {
-                "id": "text-embedding-ada-002",
-                "object": "model",
-                "created": 1671217299,
-                "owned_by": "openai-internal"
-            },
-            {
-                "id": "text-embedding-3-small",
-                "object": "model",
-                "created": 1705948997,
-                "owned_by": "system"
-            },
-            {
-                "id": "text-embedding-3-large",
-                "object": "model",
-                "created": 1705953180,
-                "owned_by": "system"
-            }
-        ]
+        "data": AVAILABLE_MODELS
     }
 
 @app.post("/v1/messages")
@@ -905,11 +3671,12 @@ async def anthropic_messages(request: AnthropicRequest, raw_request: Request, _:
             print(raw_http_request)
             print("="*80 + "\n")
     
-    log_request("/v1/messages (Anthropic)", request_dict)
+    await log_request("/v1/messages (Anthropic)", request_dict, raw_request)
     
     try:
         stream_param = request.stream if request.stream is not None else False
-        user_response = await handle_request("/v1/messages (Anthropic)", request_dict, stream_param, raw_http_request if advanced_mode else None)
+        user_response = await handle_request("/v1/messages (Anthropic)", request_dict, stream_param, raw_http_request if advanced_mode else None,
+                                             raw_request)
     except HTTPException as e:
         return Response(
             content=json.dumps({"error": {"type": "error", "message": e.detail}}),
@@ -923,6 +3690,8 @@ async def anthropic_messages(request: AnthropicRequest, raw_request: Request, _:
             media_type="application/json"
         )
     
+    raw_request.state.response_body = user_response
+    
     # Calculate token usage (approximation)
     prompt_tokens = 0
     if request.system:
@@ -943,9 +3712,13 @@ async def anthropic_messages(request: AnthropicRequest, raw_request: Request, _:
                     prompt_tokens += count_tokens(str(item))
     
     completion_tokens = count_tokens(user_response)
+    raw_request.state.usage = {"prompt_tokens": int(prompt_tokens), "completion_tokens": int(completion_tokens)}
     
     if stream_param:
         # Streaming response for Anthropic
+        pacer = StreamPacer(select_latency_profile(raw_request, request_dict), user_response)
+        chunks = stream_chunks(raw_request, user_response)
+        
         async def generate_anthropic_stream():
             # Send initial message_start event
             start_event = {
@@ -976,15 +3749,11 @@ async def anthropic_messages(request: AnthropicRequest, raw_request: Request, _:
                 }
             }
             yield f"event: content_block_start\ndata: {json.dumps(content_start)}\n\n"
+            await pacer.wait()  # Time to first token
             
             # Send content in chunks
-            words = user_response.split()
             output_tokens = 0
-            for i in range(0, len(words), 3):  # Send 3 words at a time
-                chunk_content = ' '.join(words[i:i+3])
-                if i + 3 < len(words):
-                    chunk_content += ' '
-                
+            for chunk_content in chunks:
                 output_tokens += count_tokens(chunk_content)
                 
                 delta_event = {
@@ -996,7 +3765,7 @@ async def anthropic_messages(request: AnthropicRequest, raw_request: Request, _:
                     }
                 }
                 yield f"event: content_block_delta\ndata: {json.dumps(delta_event)}\n\n"
-                await asyncio.sleep(0.1)  # Simulate streaming delay
+                await pacer.wait(chunk_content)
             
             # Send content_block_stop
             content_stop = {
@@ -1043,7 +3812,7 @@ async def anthropic_messages(request: AnthropicRequest, raw_request: Request, _:
                 "output_tokens": int(completion_tokens)
             }
         }
-        return response
+        return timed_json_response("/v1/messages (Anthropic)", response)
 
 @app.get("/")
 async def root():
@@ -1076,6 +3845,18 @@ async def server_info():
         "mode": response_mode,
         "remote_mode": remote_mode,
         "api_key_required": remote_mode,
+        "request_log": request_log_writer.stats(),
+        "request_store": request_store.stats() if request_store is not None else None,
+        "blob_store": blob_store.stats() if blob_store is not None else None,
+        "log_sampling": log_sampler.stats() if log_sampler is not None else None,
+        "replay_cassette": replay_cassette.stats() if replay_cassette is not None else None,
+        "record_cassette": record_cassette.stats() if record_cassette is not None else None,
+        "rules": response_rules.stats() if response_rules is not None else None,
+        "synthetic": synthetic_responder.stats() if synthetic_responder is not None else None,
+        "latency_profiles": {name: profile.to_dict() for name, profile in latency_profiles.items()},
+        "default_latency_profile": default_latency_profile,
+        "embedding_cache": embedding_cache.stats(),
+        "embedding_pools": {dimensions: pool.stats() for dimensions, pool in random_embedding_pools.items()},
         "supported_endpoints": [
             "/v1/chat/completions (OpenAI)",
             "/v1/completions (OpenAI)",
@@ -1085,6 +3866,231 @@ async def server_info():
         ]
     }
 
+def parse_time_filter(value: Optional[str]) -> Optional[str]:
+    """Turn an ISO timestamp or a relative duration such as '15m', '1h' or '7d' into an ISO timestamp"""
+    if not value:
+        return None
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    if value[-1] in units:
+        try:
+            seconds = float(value[:-1]) * units[value[-1]]
+        except ValueError:
+            pass
+        else:
+            return (datetime.now() - timedelta(seconds=seconds)).isoformat()
+    # Raises ValueError for anything else
+    return datetime.fromisoformat(value).isoformat()
+
+def encode_search_cursor(row: sqlite3.Row) -> str:
+    return base64.urlsafe_b64encode(json.dumps([row["ts"], row["id"]]).encode()).decode()
+
+def decode_search_cursor(cursor: str) -> tuple:
+    timestamp, record_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return str(timestamp), str(record_id)
+
+@app.get("/admin/requests")
+async def admin_requests(endpoint: Optional[str] = None, model: Optional[str] = None,
+                         client: Optional[str] = Query(None, alias="api_key"), status: Optional[int] = None,
+                         since: Optional[str] = None, until: Optional[str] = None, q: Optional[str] = None,
+                         cursor: Optional[str] = None, limit: int = Query(50, ge=1, le=500),
+                         _: Any = Depends(verify_api_key)):
+    """Search captured requests in the request store, newest first"""
+    if request_store is None:
+        return JSONResponse(
+            content={"error": {"message": "Request store is disabled; start the server with --request-store",
+                               "type": "server_error"}},
+            status_code=503
+        )
+    
+    try:
+        since, until = parse_time_filter(since), parse_time_filter(until)
+        after = decode_search_cursor(cursor) if cursor else None
+    except (ValueError, TypeError) as e:
+        return JSONResponse(
+            content={"error": {"message": f"Invalid filter: {e}", "type": "invalid_request_error"}},
+            status_code=400
+        )
+    
+    # Fetch one extra row to know whether there is another page
+    rows = await asyncio.to_thread(request_store.search, endpoint=endpoint, model=model, api_key=client,
+                                   status=status, since=since, until=until, text=q, cursor=after,
+                                   limit=limit + 1)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    data = []
+    for row in rows:
+        try:
+            request_data = json.loads(row["request_body"]) if row["request_body"] else None
+        except ValueError:
+            request_data = row["request_body"]
+        data.append({
+            "id": row["id"],
+            "timestamp": row["ts"],
+            "endpoint": row["endpoint"],
+            "model": row["model"],
+            "api_key": row["api_key"],
+            "status": row["status"],
+            "latency_ms": row["latency_ms"],
+            "request": request_data,
+            "response": row["response_body"]
+        })
+    
+    return {
+        "object": "list",
+        "data": data,
+        "has_more": has_more,
+        "next_cursor": encode_search_cursor(rows[-1]) if has_more else None
+    }
+
+EXPORT_FORMATS = ("jsonl", "csv")
+# Same columns as the web UI's client-side CSV export, plus the outcome from the request store
+EXPORT_CSV_HEADER = ['Timestamp', 'Endpoint', 'Model', 'Request ID', 'Temperature', 'Max Tokens', 'Stream',
+                     'Message Preview', 'Status', 'Latency (ms)']
+# Export output is flushed to the client in chunks of about this size
+EXPORT_CHUNK_BYTES = 64 * 1024
+# Log-backed exports hold at most this many requests while waiting for their response records
+EXPORT_PENDING_LIMIT = 10000
+
+def iter_export_lines(endpoint: Optional[str], model: Optional[str], since: Optional[str], until: Optional[str]):
+    """Yield matching requests as JSON lines from the request store, or from the request log without one"""
+    if request_store is not None:
+        for row in request_store.iter_rows(endpoint=endpoint, model=model, since=since, until=until):
+            # request_body is stored as JSON already and is spliced in without re-encoding
+            yield (
+                f'{{"timestamp": {encode_json_string(row["ts"])}, '
+                f'"id": {encode_json_string(row["id"])}, '
+                f'"endpoint": {encode_json_string(row["endpoint"])}, '
+                f'"model": {json.dumps(row["model"])}, '
+                f'"api_key": {json.dumps(row["api_key"])}, '
+                f'"status": {json.dumps(row["status"])}, '
+                f'"latency_ms": {json.dumps(row["latency_ms"])}, '
+                f'"request": {row["request_body"] or "null"}, '
+                f'"response": {json.dumps(row["response_body"])}}}'
+            )
+        return
+    
+    # Without a store, each request is joined with the response record that follows it in the log.
+    # Requests are held back in log order until their outcome arrives (or too many are waiting).
+    pending = OrderedDict()  # id -> [request line, outcome fields or None]
+    for line in iter_log_lines(since=since):
+        timestamp = log_record_timestamp(line) or ""
+        if until and timestamp > until and not pending:
+            break
+        if is_event_record(line):
+            record = json.loads(line)
+            entry = pending.get(record.get("id")) if record.get("event") == "response" else None
+            if entry is not None:
+                entry[1] = (f', "status": {json.dumps(record.get("status"))}, '
+                            f'"latency_ms": {json.dumps(record.get("latency_ms"))}, '
+                            f'"response": {json.dumps(record.get("response"))}}}')
+        elif not until or timestamp <= until:
+            record = json.loads(line)
+            if endpoint is not None and record.get("endpoint") != endpoint:
+                continue
+            if model is not None and (record.get("request") or {}).get("model") != model:
+                continue
+            pending[record.get("id")] = [line, None]
+        
+        while pending:
+            request_line, outcome = next(iter(pending.values()))
+            if outcome is None and len(pending) <= EXPORT_PENDING_LIMIT:
+                break
+            pending.popitem(last=False)
+            yield request_line[:-1] + outcome if outcome else request_line
+    
+    for request_line, outcome in pending.values():
+        yield request_line[:-1] + outcome if outcome else request_line
+
+def export_csv_row(line: str) -> List[Any]:
+    record = json.loads(line)
+    request_data = record.get("request") or {}
+    preview = last_user_message(request_data, max_length=101) or ""
+    if len(preview) > 100:
+        preview = preview[:100] + "..."
+    return [
+        record.get("timestamp", ""),
+        record.get("endpoint", ""),
+        request_data.get("model", ""),
+        record.get("id", ""),
+        request_data.get("temperature", ""),
+        request_data.get("max_tokens") or "",
+        request_data.get("stream") or False,
+        preview,
+        record.get("status", ""),
+        record.get("latency_ms", "")
+    ]
+
+def stream_export(export_format: str, endpoint: Optional[str], model: Optional[str],
+                  since: Optional[str], until: Optional[str]):
+    """Encode matching requests in batches; runs in Starlette's thread pool, one chunk at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if export_format == "csv":
+        writer.writerow(EXPORT_CSV_HEADER)
+    for line in iter_export_lines(endpoint, model, since, until):
+        if export_format == "csv":
+            writer.writerow(export_csv_row(line))
+        else:
+            buffer.write(line)
+            buffer.write("\n")
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+@app.get("/admin/export")
+async def admin_export(format: str = "jsonl", endpoint: Optional[str] = None, model: Optional[str] = None,
+                       since: Optional[str] = None, until: Optional[str] = None,
+                       _: Any = Depends(verify_api_key)):
+    """Stream captured requests as JSON lines or CSV"""
+    if format not in EXPORT_FORMATS:
+        return JSONResponse(
+            content={"error": {"message": f"Unsupported export format: {format}", "type": "invalid_request_error"}},
+            status_code=400
+        )
+    try:
+        since, until = parse_time_filter(since), parse_time_filter(until)
+    except ValueError as e:
+        return JSONResponse(
+            content={"error": {"message": f"Invalid filter: {e}", "type": "invalid_request_error"}},
+            status_code=400
+        )
+    
+    filename = f"ai_requests_{datetime.now().strftime('%Y-%m-%d')}.{format}"
+    return StreamingResponse(
+        stream_export(format, endpoint, model, since, until),
+        media_type="text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.get("/blobs/{digest}")
+async def get_blob(digest: str, _: Any = Depends(verify_api_key)):
+    """Serve a blob referenced as {"$blob": digest} in logs and web UI messages"""
+    if blob_store is None or len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+        raise HTTPException(status_code=404, detail="Not found")
+    path = blob_store.path(digest)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Not found")
+    # Content never changes for a digest
+    return FileResponse(path, media_type="text/plain; charset=utf-8",
+                        headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+@app.get("/metrics")
+async def get_metrics(_: Any = Depends(verify_api_key)):
+    """Prometheus text format metrics"""
+    gauges = {
+        "dummy_ai_requests_in_flight": ("API requests currently being handled", metrics.in_flight),
+        "dummy_ai_pending_requests": ("Requests waiting for the CLI or web UI responder",
+                                      len(pending_requests) + len(cli_pending)),
+        "dummy_ai_websocket_clients": ("Connected web UI clients", len(websocket_clients)),
+        "dummy_ai_stream_timers": ("Streamed responses waiting for their next chunk", timer_wheel.pending),
+        "dummy_ai_log_queue_depth": ("Request log records waiting to be written", request_log_writer.stats()["queued"]),
+    }
+    return Response(content=metrics.render(gauges), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/api_key_info")
 async def get_api_key_info():
     """Get API key information - only accessible in web mode without authentication"""
@@ -1140,13 +4146,80 @@ async def websocket_endpoint(websocket: WebSocket):
     except WebSocketDisconnect:
         websocket_clients.remove(websocket)
 
+async def start_cli_responder():
+    """Start the terminal reader thread and dispatcher in CLI mode"""
+    global cli_input_queue, cli_dispatcher_task
+    if response_mode != "cli":
+        return
+    
+    cli_input_queue = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+    reader = threading.Thread(target=cli_stdin_reader, args=(loop, cli_input_queue),
+                              name="cli-stdin-reader", daemon=True)
+    reader.start()
+    cli_dispatcher_task = asyncio.create_task(cli_dispatcher())
+
+app.router.add_event_handler("startup", start_cli_responder)
+
+log_summary_task: Optional[asyncio.Task] = None
+
+async def write_log_summaries():
+    """Write sampling summaries on time even when no more requests are skipped"""
+    while True:
+        await asyncio.sleep(min(log_sampler.summary_interval, 1.0))
+        log_sampler.flush_if_due()
+
+async def start_log_summaries():
+    """Start the sampling summary timer when log sampling is enabled"""
+    global log_summary_task
+    if log_sampler is not None:
+        log_summary_task = asyncio.create_task(write_log_summaries())
+
+def start_request_log_writer():
+    """Start the request log writer thread"""
+    request_log_writer.start()
+
+def stop_request_log_writer():
+    """Flush pending request log records on shutdown"""
+    if log_summary_task is not None:
+        log_summary_task.cancel()
+    if log_sampler is not None:
+        log_sampler.flush()
+    request_log_writer.close()
+
+def load_replay_cassette():
+    """Build the replay cassette index in the background so the first request doesn't wait for it"""
+    if replay_cassette is not None:
+        threading.Thread(target=replay_cassette.index, name="cassette-index", daemon=True).start()
+
+def start_request_store():
+    """Start the request store writer, which first catches up with the request log"""
+    if request_store is not None:
+        request_store.start()
+
+def stop_request_store():
+    """Commit pending request store rows on shutdown"""
+    if request_store is not None:
+        request_store.close()
+
+app.router.add_event_handler("startup", start_request_log_writer)
+app.router.add_event_handler("startup", start_request_store)
+app.router.add_event_handler("startup", start_log_summaries)
+app.router.add_event_handler("startup", load_replay_cassette)
+app.router.add_event_handler("shutdown", stop_request_log_writer)
+app.router.add_event_handler("shutdown", stop_request_store)
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="OpenAI API Mock Server")
-    parser.add_argument("--mode", choices=["cli", "web"], default="cli",
-                        help="Response mode: 'cli' for terminal input, 'web' for web UI")
+    parser.add_argument("--mode", choices=["cli", "web", "synthetic"], default="cli",
+                        help="Response mode: 'cli' for terminal input, 'web' for web UI, "
+                             "'synthetic' to answer automatically with generated text")
+    parser.add_argument("--synthetic-length", default="lognormal:200:0.6",
+                        help="Output length in tokens in synthetic mode: fixed:N, uniform:MIN:MAX, normal:MEAN:STDDEV, "
+                             "lognormal:MEDIAN:SIGMA, exponential:MEAN or max_tokens (default: lognormal:200:0.6)")
     parser.add_argument("--port", type=int, default=8000,
                         help="Port to run the server on")
     parser.add_argument("--host", default="0.0.0.0",
@@ -1155,11 +4228,183 @@ if __name__ == "__main__":
                         help="Run in remote mode with API key authentication")
     parser.add_argument("--advanced", action="store_true",
                         help="Show raw HTTP requests (available in both CLI and web modes)")
+    parser.add_argument("--log-queue-size", type=int, default=10000,
+                        help="Maximum number of request log records waiting to be written")
+    parser.add_argument("--log-flush-interval", type=float, default=0.5,
+                        help="Seconds between request log writes")
+    parser.add_argument("--log-overflow", choices=["drop", "block"], default="drop",
+                        help="When the log queue is full: 'drop' new records or 'block' requests until there is room")
+    parser.add_argument("--log-sample", type=int, default=1, metavar="N",
+                        help="Log only 1 in N requests per endpoint (errors, slow and --log-always requests are kept)")
+    parser.add_argument("--log-rate-limit", type=float, default=0,
+                        help="Log at most this many requests per second per endpoint (0 disables)")
+    parser.add_argument("--log-always", metavar="REGEX",
+                        help="With sampling, always log requests whose model or last user message matches REGEX")
+    parser.add_argument("--log-slow-ms", type=float, default=1000,
+                        help="With sampling, always log requests taking at least this long (0 disables)")
+    parser.add_argument("--log-summary-interval", type=float, default=60,
+                        help="Seconds between summary records of requests skipped by sampling")
+    parser.add_argument("--log-max-bytes", type=int, default=64 * 1024 * 1024,
+                        help="Rotate request_log.json and the text log at this size (0 disables size rotation)")
+    parser.add_argument("--log-rotate-interval", type=float, default=0,
+                        help="Also rotate request_log.json after this many seconds (0 disables)")
+    parser.add_argument("--log-index-every", type=int, default=1000,
+                        help="Records per independently decompressible block in rotated segments")
+    parser.add_argument("--log-max-segments", type=int, default=0,
+                        help="Keep at most this many compressed request log segments (0 keeps all)")
+    parser.add_argument("--log-backup-count", type=int, default=5,
+                        help="Compressed backups kept of the text log file")
+    parser.add_argument("--request-store", metavar="DB_FILE",
+                        help="Also record requests and responses in this SQLite database (WAL mode, batched inserts)")
+    parser.add_argument("--blob-store", metavar="DIR",
+                        help="Store large strings and images once in this content-addressed directory and "
+                             "reference them from logs and web UI messages")
+    parser.add_argument("--blob-min-bytes", type=int, default=4096,
+                        help="Strings at least this long go to the blob store (default: 4096)")
+    parser.add_argument("--rebuild-request-store", action="store_true",
+                        help="Re-ingest the whole request log into the request store on start, not just newer records")
+    parser.add_argument("--compact-logs", action="store_true",
+                        help="Convert closed request log segments into columnar NumPy files and exit")
+    parser.add_argument("--aggregate-logs", metavar="FIELDS",
+                        help="Compact the request log, print totals grouped by comma-separated fields "
+                             f"({', '.join(COMPACT_LOG_GROUPS)}) and exit")
+    parser.add_argument("--latency-profile", default="default",
+                        help="Streaming latency profile used unless the X-Latency-Profile header, a rule or "
+                             "the model selects another (default: 'default', the original 100ms per 3 words)")
+    parser.add_argument("--latency-profiles", metavar="JSON_FILE",
+                        help="Add or override latency profiles from a JSON object of name -> settings")
+    parser.add_argument("--stream-chunking", default=default_stream_chunking,
+                        help="How streamed responses are split unless the X-Stream-Chunking header or a rule "
+                             "selects another: char, token, bytes:N, words:N or whole (default: words:3)")
+    parser.add_argument("--rules", metavar="JSON_FILE",
+                        help="Answer matching requests automatically with rules from this file (reloaded on change)")
+    parser.add_argument("--cassette", metavar="JSONL_FILE",
+                        help="Answer requests recorded in this cassette instantly, without the CLI or web UI")
+    parser.add_argument("--replay-miss", choices=["responder", "error", "default"], default="responder",
+                        help="Requests not in the cassette: ask the 'responder', return a 404 'error' "
+                             "or the 'default' response")
+    parser.add_argument("--record-cassette", metavar="JSONL_FILE",
+                        help="Append every CLI / web UI answer to this cassette")
+    parser.add_argument("--build-cassette", metavar="JSONL_FILE",
+                        help="Record all successfully answered requests in the request log into a cassette and exit")
+    parser.add_argument("--build-embedding-store", metavar="JSON_FILE",
+                        help="Convert a JSON embeddings file into a memory-mapped binary store and exit")
+    parser.add_argument("--embedding-nn-fallback", action="store_true",
+                        help="In file mode, answer unknown texts with the embedding of the most similar known text")
+    parser.add_argument("--embedding-nn-similarity", type=float, default=1.0,
+                        help="Perturb nearest-text matches to this cosine-like similarity (default: 1.0, unchanged)")
+    parser.add_argument("--embedding-stream-threshold", type=int, default=embedding_stream_threshold,
+                        help="Stream embedding responses with at least this many values (inputs x dimensions, 0 disables)")
+    parser.add_argument("--embedding-pool-size", type=int, default=0,
+                        help="Pre-generate this many random embeddings per dimension in the background (0 disables)")
+    parser.add_argument("--embedding-pool-dimensions", type=int, nargs="+",
+                        default=sorted(set(EMBEDDING_DIMENSIONS.values())),
+                        help="Dimensions to keep random embedding pools for (default: all known model dimensions)")
+    parser.add_argument("--embedding-cache-size", type=int, default=4096,
+                        help="Number of hash-based embedding vectors kept in the LRU cache (0 disables caching)")
     
     args = parser.parse_args()
+    
+    if args.build_embedding_store:
+        try:
+            vectors_path, keys_path, texts_path, shape = build_embedding_store(args.build_embedding_store)
+        except (OSError, ValueError) as e:
+            print(f"Failed to build embedding store: {e}")
+            sys.exit(1)
+        print(f"Built embedding store with {shape[0]} vectors of {shape[1]} dimensions:")
+        print(f"  {vectors_path}")
+        print(f"  {keys_path}")
+        print(f"  {texts_path}")
+        sys.exit(0)
+    
+    if args.blob_store:
+        blob_store = BlobStore(args.blob_store, min_bytes=args.blob_min_bytes)
+    
+    if args.build_cassette:
+        recorded, skipped = build_cassette_from_log(Cassette(args.build_cassette))
+        print(f"Recorded {recorded} request log entries into {args.build_cassette}")
+        if skipped:
+            print(f"Skipped {skipped} entries with truncated base64 data or unresolved blob references")
+        sys.exit(0)
+    
+    if args.compact_logs or args.aggregate_logs:
+        group_by = [field.strip() for field in (args.aggregate_logs or "").split(",") if field.strip()]
+        unknown = [field for field in group_by if field not in COMPACT_LOG_GROUPS]
+        if unknown or (args.aggregate_logs is not None and not group_by):
+            print(f"Unknown aggregation fields: {', '.join(unknown) or args.aggregate_logs!r}; "
+                  f"choose from {', '.join(COMPACT_LOG_GROUPS)}")
+            sys.exit(1)
+        compacted = compact_logs(lookahead=args.log_index_every)
+        print(f"Compacted {len(compacted)} request log segments ({sum(c['rows'] for c in compacted)} requests)")
+        if group_by:
+            header = group_by + ["requests", "prompt_tokens", "completion_tokens", "errors", "avg_latency_ms"]
+            print("\t".join(header))
+            for row in aggregate_compacted_logs(group_by=group_by):
+                print("\t".join("" if row[column] is None else str(row[column]) for column in header))
+        sys.exit(0)
+    
     response_mode = args.mode
+    if response_mode == "synthetic":
+        try:
+            synthetic_responder = SyntheticResponder(args.synthetic_length)
+        except ValueError as e:
+            print(f"Invalid --synthetic-length: {e}")
+            sys.exit(1)
     remote_mode = args.remote
     advanced_mode = args.advanced
+    configure_file_logging(max_bytes=args.log_max_bytes, backup_count=args.log_backup_count)
+    request_log_writer = RequestLogWriter(max_queue=args.log_queue_size,
+                                          flush_interval=args.log_flush_interval,
+                                          overflow=args.log_overflow,
+                                          max_bytes=args.log_max_bytes,
+                                          rotate_interval=args.log_rotate_interval,
+                                          index_every=args.log_index_every,
+                                          max_segments=args.log_max_segments)
+    if args.latency_profiles:
+        try:
+            load_latency_profiles(args.latency_profiles)
+        except (OSError, ValueError) as e:
+            print(f"Failed to load latency profiles: {e}")
+            sys.exit(1)
+    if args.latency_profile not in latency_profiles:
+        print(f"Unknown latency profile {args.latency_profile!r}; choose from {', '.join(latency_profiles)}")
+        sys.exit(1)
+    default_latency_profile = args.latency_profile
+    try:
+        parse_stream_chunking(args.stream_chunking)
+    except ValueError as e:
+        print(f"Invalid --stream-chunking: {e}")
+        sys.exit(1)
+    default_stream_chunking = args.stream_chunking
+    if args.rules:
+        response_rules = ResponseRules(args.rules)
+        if response_rules.error is not None:
+            sys.exit(1)
+    if args.cassette:
+        replay_cassette = Cassette(args.cassette)
+    if args.record_cassette:
+        # Recording into the replayed cassette makes new answers replayable right away
+        same_file = replay_cassette is not None and os.path.abspath(args.record_cassette) == os.path.abspath(args.cassette)
+        record_cassette = replay_cassette if same_file else Cassette(args.record_cassette)
+    replay_miss = args.replay_miss
+    if args.request_store:
+        request_store = RequestStore(args.request_store, max_queue=args.log_queue_size,
+                                     flush_interval=args.log_flush_interval,
+                                     rebuild=args.rebuild_request_store)
+    if args.log_sample > 1 or args.log_rate_limit > 0:
+        try:
+            log_sampler = LogSampler(every=args.log_sample, rate=args.log_rate_limit, always=args.log_always,
+                                     slow_ms=args.log_slow_ms, summary_interval=args.log_summary_interval)
+        except re.error as e:
+            print(f"Invalid --log-always pattern: {e}")
+            sys.exit(1)
+    embedding_cache.maxsize = args.embedding_cache_size
+    embedding_stream_threshold = args.embedding_stream_threshold
+    embedding_nn_fallback = args.embedding_nn_fallback
+    embedding_nn_similarity = args.embedding_nn_similarity
+    if args.embedding_pool_size > 0:
+        for dimensions in args.embedding_pool_dimensions:
+            random_embedding_pools[dimensions] = RandomEmbeddingPool(dimensions, args.embedding_pool_size)
     
     # Generate API key if in remote mode
     if remote_mode:
@@ -1189,12 +4434,23 @@ if __name__ == "__main__":
     print("  - Console output")
     print("  - dummy_ai_endpoint_requests.log")
     print("  - request_log.json")
+    if request_store is not None:
+        print(f"  - {request_store.path} (SQLite)")
+    if response_rules is not None:
+        print(f"\nAnswering {len(response_rules.rules)} rules from {response_rules.path} automatically")
+    if replay_cassette is not None:
+        print(f"\nReplaying answers from {replay_cassette.path} (misses: {replay_miss})")
+    if record_cassette is not None:
+        print(f"Recording answers into {record_cassette.path}")
     
     if advanced_mode:
         print("\n⚡ ADVANCED MODE ENABLED ⚡")
         print("Raw HTTP requests will be displayed for each incoming request.")
     if response_mode == "cli":
         print("\nYou will be prompted to provide responses for each request.")
+        print("Requests wait in a queue; type 'list' to see them and a request ID to answer one.")
+    elif response_mode == "synthetic":
+        print(f"\nRequests are answered automatically with generated text ({synthetic_responder.length} tokens).")
     else:
         print("\nOpen the web UI to manage responses.")
     print("="*80 + "\n")
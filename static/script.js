@@ -1,6 +1,10 @@
 let ws = null;
 let currentRequestId = null;
 let requestHistory = [];
+const blobCache = new Map();
+// Resolves to the API key in remote mode (null otherwise), once /api_key_info has answered
+let apiKeyReady = Promise.resolve(null);
+let messageQueue = Promise.resolve();
 
 // Button loading state helper
 function setButtonLoading(button, isLoading) {
@@ -19,6 +23,12 @@ async function fetchApiKeyInfo() {
         const response = await fetch('/api_key_info');
         const data = await response.json();
         
+        if (data.remote_mode) {
+            // Server exports need the API key header, which a plain download link can't send
+            document.getElementById('export-server-jsonl').classList.add('hidden');
+            document.getElementById('export-server-csv').classList.add('hidden');
+        }
+        
         if (data.remote_mode && data.api_key) {
             document.getElementById('api-key-section').classList.remove('hidden');
             document.getElementById('api-key-value').textContent = data.api_key;
@@ -36,9 +46,43 @@ async function fetchApiKeyInfo() {
                 });
             });
         }
+        return data.remote_mode ? data.api_key : null;
     } catch (error) {
         console.error('Failed to fetch API key info:', error);
+        return null;
+    }
+}
+
+// Large payloads arrive as {"$blob": sha256, "bytes": n} references; each blob is fetched once
+function fetchBlob(digest) {
+    if (!blobCache.has(digest)) {
+        // Blobs hold full request bodies, so remote mode requires the API key for them
+        blobCache.set(digest, apiKeyReady.then(key => fetch(`/blobs/${digest}`, {
+            headers: key ? { 'Authorization': `Bearer ${key}` } : {}
+        })).then(response => {
+            if (!response.ok) {
+                throw new Error(`Blob ${digest} not found`);
+            }
+            return response.text();
+        }));
+    }
+    return blobCache.get(digest);
+}
+
+async function resolveBlobs(value) {
+    if (Array.isArray(value)) {
+        return Promise.all(value.map(resolveBlobs));
     }
+    if (value && typeof value === 'object') {
+        if (typeof value.$blob === 'string') {
+            return fetchBlob(value.$blob);
+        }
+        const entries = await Promise.all(
+            Object.entries(value).map(async ([key, item]) => [key, await resolveBlobs(item)])
+        );
+        return Object.fromEntries(entries);
+    }
+    return value;
 }
 
 function connectWebSocket() {
@@ -52,7 +96,11 @@ function connectWebSocket() {
     
     ws.onmessage = (event) => {
         const data = JSON.parse(event.data);
-        handleMessage(data);
+        // Resolve blob references before handling, keeping messages in arrival order
+        messageQueue = messageQueue
+            .then(() => resolveBlobs(data))
+            .then(handleMessage)
+            .catch(error => console.error('Failed to handle message:', error));
     };
     
     ws.onclose = () => {
@@ -463,6 +511,16 @@ function sendResponse() {
                 setButtonLoading(button, false);
                 return;
             }
+        } else if (embeddingType === 'clustered') {
+            const clusters = parseInt(document.getElementById('embedding-clusters').value, 10);
+            const similarity = parseFloat(document.getElementById('embedding-similarity').value);
+            if (!(clusters >= 1) || !(similarity >= 0 && similarity <= 1)) {
+                alert('Please enter at least 1 cluster and a similarity between 0 and 1');
+                setButtonLoading(button, false);
+                return;
+            }
+            embeddingData.clusters = clusters;
+            embeddingData.similarity = similarity;
         }
         
         const message = {
@@ -979,6 +1037,14 @@ function exportToCSV() {
     link.click();
 }
 
+function exportFromServer(format) {
+    // The server streams the export straight to disk, so it covers the whole request log,
+    // not just this tab's history, without building the file in the browser
+    const link = document.createElement('a');
+    link.href = `/admin/export?format=${format}`;
+    link.click();
+}
+
 // Initialize
 document.addEventListener('DOMContentLoaded', () => {
     // Initialize theme
@@ -988,7 +1054,7 @@ document.addEventListener('DOMContentLoaded', () => {
     document.getElementById('theme-toggle').addEventListener('click', toggleTheme);
     
     // Fetch API key info
-    fetchApiKeyInfo();
+    apiKeyReady = fetchApiKeyInfo();
     
     // WebSocket connection
     connectWebSocket();
@@ -1013,6 +1079,8 @@ document.addEventListener('DOMContentLoaded', () => {
     // Export button event listeners
     document.getElementById('export-json').addEventListener('click', exportToJSON);
     document.getElementById('export-csv').addEventListener('click', exportToCSV);
+    document.getElementById('export-server-jsonl').addEventListener('click', () => exportFromServer('jsonl'));
+    document.getElementById('export-server-csv').addEventListener('click', () => exportFromServer('csv'));
     
     // Allow Ctrl+Enter to send response
     document.getElementById('response-input').addEventListener('keydown', (e) => {
@@ -1025,16 +1093,20 @@ document.addEventListener('DOMContentLoaded', () => {
     document.getElementById('embedding-type').addEventListener('change', (e) => {
         const fileInput = document.getElementById('embedding-file-input');
         const customInput = document.getElementById('embedding-custom-input');
+        const clusteredInput = document.getElementById('embedding-clustered-input');
         
         // Hide all optional inputs first
         fileInput.classList.add('hidden');
         customInput.classList.add('hidden');
+        clusteredInput.classList.add('hidden');
         
         // Show relevant input based on selection
         if (e.target.value === 'file') {
             fileInput.classList.remove('hidden');
         } else if (e.target.value === 'custom') {
             customInput.classList.remove('hidden');
+        } else if (e.target.value === 'clustered') {
+            clusteredInput.classList.remove('hidden');
         }
     });
 });
\ No newline at end of file
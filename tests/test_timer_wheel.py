@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Test script for the timer wheel that paces streamed responses.
+Runs in-process, no server needed: python tests/test_timer_wheel.py
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+# The server module mounts static/ relative to the working directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+
+from dummy_ai_endpoint import TimerWheel
+
+def test_sleep_while_loop_is_busy():
+    """A sleeper registered just before the loop blocks must still wake up on time"""
+    
+    async def run():
+        wheel = TimerWheel()
+        
+        async def hog():
+            # Holds the loop before the wheel's driver task gets its first step
+            time.sleep(0.01)
+        
+        started = time.perf_counter()
+        sleeper = asyncio.create_task(wheel.sleep(0.001))
+        await asyncio.sleep(0)
+        await hog()
+        await asyncio.wait_for(sleeper, timeout=1.0)
+        return time.perf_counter() - started, wheel.pending
+    
+    elapsed, pending = asyncio.run(run())
+    print(f"Woke after {elapsed * 1000:.1f}ms, {pending} pending")
+    assert pending == 0
+    assert elapsed < 0.1
+
+def test_sleepers_with_different_deadlines():
+    """Sleepers added before the driver runs wake in deadline order"""
+    
+    async def run():
+        wheel = TimerWheel()
+        woken = []
+        
+        async def sleeper(delay):
+            await wheel.sleep(delay)
+            woken.append(delay)
+        
+        await asyncio.wait_for(asyncio.gather(*(sleeper(delay) for delay in (0.05, 0.001, 0.02))), timeout=1.0)
+        return woken, wheel.pending
+    
+    woken, pending = asyncio.run(run())
+    print(f"Woken in order {woken}, {pending} pending")
+    assert woken == [0.001, 0.02, 0.05]
+    assert pending == 0
+
+if __name__ == "__main__":
+    print("🚀 Testing the stream timer wheel")
+    print("=" * 50)
+    test_sleep_while_loop_is_busy()
+    test_sleepers_with_different_deadlines()
+    print("✅ All timer wheel tests passed")